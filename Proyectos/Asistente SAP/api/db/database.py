@@ -6,12 +6,15 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 from sqlalchemy.orm import declarative_base
 from config import settings
 
-# Motor de base de datos
+# Motor de base de datos; el pool mantiene conexiones abiertas entre peticiones
+# (pool_size fijas + max_overflow bajo picos) para no pagar conexión y auth cada vez
 engine = create_async_engine(
     settings.database_url,
     echo=settings.api_log_level == "debug",
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
     pool_pre_ping=True,
-    pool_recycle=300
+    pool_recycle=settings.db_pool_recycle
 )
 
 # Session factory
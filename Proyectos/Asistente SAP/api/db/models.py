@@ -7,7 +7,7 @@ from datetime import datetime
 from typing import List, Optional
 from sqlalchemy import (
     Column, String, Text, Integer, DateTime, Boolean, 
-    ForeignKey, ARRAY, JSON, UUID, CheckConstraint, Index
+    ForeignKey, ARRAY, JSON, UUID, CheckConstraint, Index, LargeBinary
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -137,6 +137,15 @@ class EvalRun(Base):
     )
 
 
+class EmbeddingCache(Base):
+    __tablename__ = "embedding_cache"
+    
+    text_hash = Column(String(64), primary_key=True)  # sha256 del texto
+    model = Column(String(100), primary_key=True)
+    vector = Column(LargeBinary, nullable=False)  # float32 little-endian (np.frombuffer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     
@@ -16,7 +16,7 @@ import time
 
 from config import settings
 from db.database import init_db
-from utils.logging import configure_logging, get_logger, add_request_context
+from utils.logging import configure_logging, get_logger, request_context
 from routers import auth, ingest, search
 from routers.admin import router as admin_router
 
@@ -119,38 +119,37 @@ async def add_process_time_header(request: Request, call_next):
     except:
         pass
     
-    add_request_context(request_id, user_id, tenant)
-    
-    # Procesar request
-    try:
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        # Añadir headers
-        response.headers["X-Process-Time"] = str(process_time)
-        response.headers["X-Request-ID"] = request_id
-        
-        # Log de request
-        logger.info(
-            "Request processed",
-            method=request.method,
-            url=str(request.url),
-            status_code=response.status_code,
-            process_time=process_time
-        )
-        
-        return response
-        
-    except Exception as e:
-        process_time = time.time() - start_time
-        logger.error(
-            "Request failed",
-            method=request.method,
-            url=str(request.url),
-            error=str(e),
-            process_time=process_time
-        )
-        raise
+    # Procesar request con el contexto añadido a los logs
+    with request_context(request_id, user_id, tenant):
+        try:
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            
+            # Añadir headers
+            response.headers["X-Process-Time"] = str(process_time)
+            response.headers["X-Request-ID"] = request_id
+            
+            # Log de request
+            logger.info(
+                "Request processed",
+                method=request.method,
+                url=str(request.url),
+                status_code=response.status_code,
+                process_time=process_time
+            )
+            
+            return response
+            
+        except Exception as e:
+            process_time = time.time() - start_time
+            logger.error(
+                "Request failed",
+                method=request.method,
+                url=str(request.url),
+                error=str(e),
+                process_time=process_time
+            )
+            raise
 
 
 # Incluir routers
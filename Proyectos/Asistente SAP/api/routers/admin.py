@@ -265,7 +265,7 @@ async def reindex_documents(
                 if doc.chunks:
                     point_ids = [chunk.qdrant_point_id for chunk in doc.chunks if chunk.qdrant_point_id]
                     if point_ids:
-                        await qdrant_service.delete_points(point_ids)
+                        await qdrant_service.delete_points(point_ids, tenants=[doc.tenant_slug])
                 
                 # Eliminar chunks de PostgreSQL
                 for chunk in doc.chunks:
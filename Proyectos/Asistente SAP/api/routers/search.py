@@ -22,6 +22,9 @@ from utils.logging import get_logger
 logger = get_logger(__name__)
 router = APIRouter(prefix="/search", tags=["Search & Chat"])
 
+# Campos del payload de Qdrant que usa el chat (contexto del LLM y fuentes)
+CHAT_PAYLOAD_FIELDS = ["content", "source", "title", "tenant", "scope", "document_id"]
+
 
 @router.post("/chat-public", response_model=ChatResponse)
 async def chat_public(
@@ -60,7 +63,8 @@ async def chat_public(
             query_vector=query_embedding,
             tenant_filter=tenant_filter,
             top_k=settings.rag_context_chunks,
-            filters=search_filters
+            filters=search_filters,
+            payload_fields=CHAT_PAYLOAD_FIELDS
         )
         
         # 2. Preparar contexto para el LLM
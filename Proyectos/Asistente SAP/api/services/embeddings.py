@@ -2,38 +2,147 @@
 Servicio de embeddings y vectorización
 Wiki Inteligente SAP IS-U
 """
+import asyncio
+import functools
 import hashlib
+import logging
+import time
+from array import array
+from collections import OrderedDict
+import aiohttp
 import tiktoken
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, before_sleep_log
 from qdrant_client import AsyncQdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, MatchAny
+from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, MatchAny, SearchRequest, PayloadSelectorInclude
+from qdrant_client.models import ScalarQuantization, ScalarQuantizationConfig, ScalarType
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import settings
+from utils.cache import SearchCache
 from utils.logging import get_logger
+from utils.ratelimit import RateLimiter, RETRYABLE_OPENAI_ERRORS, wait_retry_after
 
 logger = get_logger(__name__)
 
+# Límites por petición del endpoint de embeddings de OpenAI
+EMBEDDING_MAX_BATCH = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 290_000
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_CONCURRENCY = 8
+# Vectores recientes en memoria (LRU) por proceso. Se guardan como float32
+# compactos (~6KB por vector de 1536 dimensiones): ~60MB por proceso a tope
+EMBEDDING_CACHE_SIZE = 10_000
+
+COLLECTION_INFO_TTL = 5.0  # Segundos que se reutiliza la info de colección (health checks)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_encoder(model: str) -> "tiktoken.Encoding":
+    """Encoder de tiktoken por modelo, construido una sola vez por proceso"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Modelo desconocido para tiktoken: mismo vocabulario que los embeddings actuales
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# Limitador compartido para el modelo de embeddings (OpenAI lo limita aparte del chat)
+_embedding_rate_limiter = RateLimiter(rpm=settings.embedding_rpm, tpm=settings.embedding_tpm)
+
 
 class EmbeddingService:
+    # Caché LRU (modelo:sha256 -> vector) compartida por todas las instancias del
+    # proceso, ya que el servicio se instancia por petición
+    _cache: "OrderedDict[str, array]" = OrderedDict()
+    
     def __init__(self):
         self.client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.model = settings.embedding_model
-        self.encoding = tiktoken.encoding_for_model("gpt-4")
+        self.encoding = _get_encoder(self.model)
     
     async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Obtener embeddings para lista de textos"""
+        """Obtener embeddings para lista de textos; solo se piden a OpenAI los no cacheados"""
+        cache = self._cache
+        keys = [f"{self.model}:{self.generate_content_hash(text)}" for text in texts]
+        
+        resolved: Dict[str, array] = {}
+        missing: Dict[str, str] = {}  # Textos únicos sin caché, en orden de aparición
+        for key, text in zip(keys, texts):
+            if key in cache:
+                cache.move_to_end(key)
+                resolved[key] = cache[key]
+            elif key not in missing:
+                missing[key] = text
+        
+        if missing:
+            vectors = await self._request_embeddings(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                stored = array("f", vector)
+                resolved[key] = stored
+                cache[key] = stored
+                if len(cache) > EMBEDDING_CACHE_SIZE:
+                    cache.popitem(last=False)
+        
+        # Copia por posición: el llamador puede modificar su lista sin tocar la caché
+        return [resolved[key].tolist() for key in keys]
+    
+    async def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Pedir embeddings a OpenAI en lotes concurrentes, conservando el orden"""
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+        
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_batch(batch)
+        
         try:
-            response = await self.client.embeddings.create(
-                model=self.model,
-                input=texts
-            )
-            return [embedding.embedding for embedding in response.data]
+            results = await asyncio.gather(*[
+                embed_batch(batch) for batch in self._pack_batches(texts)
+            ])
+            return [embedding for batch in results for embedding in batch]
         except Exception as e:
             logger.error(f"Error getting embeddings: {e}")
             raise
     
+    @retry(
+        retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS),
+        wait=wait_retry_after,
+        stop=stop_after_attempt(5),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True
+    )
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Una petición de embeddings, respetando los límites RPM/TPM del modelo"""
+        await _embedding_rate_limiter.acquire(sum(len(text) for text in batch) // 4)
+        
+        response = await self.client.embeddings.create(
+            model=self.model,
+            input=batch
+        )
+        return [embedding.embedding for embedding in response.data]
+    
+    def _pack_batches(self, texts: List[str]) -> List[List[str]]:
+        """Agrupar textos en lotes que respeten el máximo de entradas y de tokens"""
+        # Si ni en el peor caso se alcanza el límite de tokens, basta con cortar por número
+        if len(texts) * EMBEDDING_MAX_INPUT_TOKENS <= EMBEDDING_MAX_BATCH_TOKENS:
+            return [texts[i:i + EMBEDDING_MAX_BATCH] for i in range(0, len(texts), EMBEDDING_MAX_BATCH)]
+        
+        batches = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            tokens = self.count_tokens(text)
+            if current and (len(current) >= EMBEDDING_MAX_BATCH or current_tokens + tokens > EMBEDDING_MAX_BATCH_TOKENS):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
     async def get_embedding(self, text: str) -> List[float]:
         """Obtener embedding para un texto"""
         embeddings = await self.get_embeddings([text])
@@ -41,33 +150,32 @@ class EmbeddingService:
     
     def count_tokens(self, text: str) -> int:
         """Contar tokens en texto"""
-        return len(self.encoding.encode(text))
+        # disallowed_special=(): textos con "<|endoftext|>" se cuentan en vez de fallar
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Contar tokens de varios textos en una sola llamada (tiktoken los codifica en paralelo)"""
+        return [len(ids) for ids in self.encoding.encode_batch(texts, disallowed_special=())]
     
     def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[Dict[str, Any]]:
         """Dividir texto en chunks con overlap"""
         chunk_size = chunk_size or settings.chunk_size
         overlap = overlap or settings.chunk_overlap
         
-        # Dividir por párrafos primero
-        paragraphs = text.split('\n\n')
+        # Dividir por párrafos primero; los tokens de todos se cuentan en una sola llamada
+        paragraphs = [paragraph.strip() for paragraph in text.split('\n\n')]
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+        paragraph_tokens = self.count_tokens_batch(paragraphs)
         chunks = []
         current_chunk = ""
         current_tokens = 0
         chunk_index = 0
         
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
-                continue
-            
-            para_tokens = self.count_tokens(paragraph)
-            
+        for paragraph, para_tokens in zip(paragraphs, paragraph_tokens):
             # Si el párrafo solo ya es muy grande, dividirlo por oraciones
             if para_tokens > chunk_size:
                 sentences = paragraph.split('. ')
-                for sentence in sentences:
-                    sentence_tokens = self.count_tokens(sentence)
-                    
+                for sentence, sentence_tokens in zip(sentences, self.count_tokens_batch(sentences)):
                     if current_tokens + sentence_tokens > chunk_size and current_chunk:
                         # Guardar chunk actual
                         chunks.append({
@@ -80,7 +188,7 @@ class EmbeddingService:
                         if overlap > 0 and current_chunk:
                             overlap_text = self._get_overlap_text(current_chunk, overlap)
                             current_chunk = overlap_text + " " + sentence
-                            current_tokens = self.count_tokens(current_chunk)
+                            current_tokens = self.count_tokens(overlap_text) + sentence_tokens
                         else:
                             current_chunk = sentence
                             current_tokens = sentence_tokens
@@ -106,7 +214,7 @@ class EmbeddingService:
                 if overlap > 0 and current_chunk:
                     overlap_text = self._get_overlap_text(current_chunk, overlap)
                     current_chunk = overlap_text + "\n\n" + paragraph
-                    current_tokens = self.count_tokens(current_chunk)
+                    current_tokens = self.count_tokens(overlap_text) + para_tokens
                 else:
                     current_chunk = paragraph
                     current_tokens = para_tokens
@@ -142,13 +250,24 @@ class EmbeddingService:
     
     def generate_content_hash(self, content: str) -> str:
         """Generar hash del contenido para deduplicación"""
-        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+        # Hash de contenido, no de seguridad: usedforsecurity=False evita restricciones FIPS
+        return hashlib.sha256(content.encode('utf-8'), usedforsecurity=False).hexdigest()
 
 
 class QdrantService:
+    # Info de colección reciente (colección -> (expira, info)), compartida entre
+    # instancias porque el servicio se crea en cada health check
+    _collection_info_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    
     def __init__(self):
-        self.client = AsyncQdrantClient(url=settings.qdrant_url)
+        # gRPC envía los vectores en binario (protobuf) en lugar de JSON
+        self.client = AsyncQdrantClient(
+            url=settings.qdrant_url,
+            grpc_port=settings.qdrant_grpc_port,
+            prefer_grpc=settings.qdrant_prefer_grpc
+        )
         self.collection_name = settings.qdrant_collection
+        self.cache = SearchCache()
     
     async def ensure_collection(self):
         """Asegurar que la colección existe"""
@@ -158,7 +277,11 @@ class QdrantService:
             # Crear colección si no existe
             await self.client.create_collection(
                 collection_name=self.collection_name,
-                vectors_config=VectorParams(size=1536, distance=Distance.COSINE)  # OpenAI embeddings
+                vectors_config=VectorParams(size=1536, distance=Distance.COSINE, on_disk=True),  # OpenAI embeddings
+                # Copia int8 en RAM para buscar; los vectores originales en disco para reordenar
+                quantization_config=ScalarQuantization(
+                    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+                )
             )
             
             # Crear índices en payload
@@ -182,6 +305,12 @@ class QdrantService:
                 field_name="system",
                 field_schema="keyword"
             )
+            # Índice de texto completo para filtros MatchText sobre el contenido
+            await self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name="content",
+                field_schema="text"
+            )
     
     async def upsert_points(self, points: List[PointStruct]):
         """Insertar o actualizar puntos en Qdrant"""
@@ -190,16 +319,80 @@ class QdrantService:
             collection_name=self.collection_name,
             points=points
         )
+        # Los resultados cacheados de estos tenants ya no reflejan la colección
+        await self.cache.invalidate({point.payload.get("tenant") for point in points if point.payload})
     
     async def search(
         self,
         query_vector: List[float],
         tenant_filter: List[str],
         top_k: int = 10,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        payload_fields: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
-        """Buscar vectores similares con filtros"""
+        """Buscar vectores similares con filtros (payload_fields limita el payload devuelto)"""
+        cache_key, = await self.cache.make_keys([query_vector], [tenant_filter], top_k, filters, payload_fields)
+        cached, = await self.cache.get_many([cache_key])
+        if cached is not None:
+            return cached
+        
+        search_result = await self.client.search(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            query_filter=self._build_filter(tenant_filter, filters),
+            limit=top_k,
+            with_payload=self._payload_selector(payload_fields),
+            with_vectors=False
+        )
         
+        results = self._format_hits(search_result)
+        await self.cache.set_many({cache_key: results})
+        return results
+    
+    async def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        tenant_filters: List[List[str]],
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        payload_fields: Optional[List[str]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Buscar varias consultas en una sola petición a Qdrant"""
+        cache_keys = await self.cache.make_keys(query_vectors, tenant_filters, top_k, filters, payload_fields)
+        results = await self.cache.get_many(cache_keys)
+        
+        # Solo se envían a Qdrant las consultas que no están en caché
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            requests = [
+                SearchRequest(
+                    vector=query_vectors[i],
+                    filter=self._build_filter(tenant_filters[i], filters),
+                    limit=top_k,
+                    with_payload=self._payload_selector(payload_fields),
+                    with_vector=False
+                )
+                for i in missing
+            ]
+            
+            batch_result = await self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=requests
+            )
+            
+            for i, search_result in zip(missing, batch_result):
+                results[i] = self._format_hits(search_result)
+            
+            await self.cache.set_many({cache_keys[i]: results[i] for i in missing})
+        
+        return results
+    
+    def _build_filter(
+        self,
+        tenant_filter: List[str],
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[Filter]:
+        """Construir filtro de tenant y metadatos"""
         # Construir filtros
         filter_conditions = []
         
@@ -233,14 +426,16 @@ class QdrantService:
                     FieldCondition(key="topic", match=MatchValue(value=filters["topic"]))
                 )
         
-        search_result = await self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            query_filter=Filter(must=filter_conditions) if filter_conditions else None,
-            limit=top_k,
-            with_payload=True
-        )
-        
+        return Filter(must=filter_conditions) if filter_conditions else None
+    
+    def _payload_selector(self, payload_fields: Optional[List[str]]):
+        """Payload completo o solo los campos pedidos"""
+        if payload_fields:
+            return PayloadSelectorInclude(include=list(payload_fields))
+        return True
+    
+    def _format_hits(self, search_result) -> List[Dict[str, Any]]:
+        """Convertir resultados de Qdrant a diccionarios"""
         return [
             {
                 "id": hit.id,
@@ -250,24 +445,59 @@ class QdrantService:
             for hit in search_result
         ]
     
-    async def delete_points(self, point_ids: List[str]):
-        """Eliminar puntos por IDs"""
+    async def delete_points(self, point_ids: List[str], tenants: Optional[List[str]] = None):
+        """Eliminar puntos por IDs (tenants acota la invalidación de la caché)"""
         await self.client.delete(
             collection_name=self.collection_name,
             points_selector=point_ids
         )
+        await self.cache.invalidate(tenants)
+    
+    async def create_snapshot(self):
+        """Crear snapshot consistente de la colección en el servidor"""
+        return await self.client.create_snapshot(collection_name=self.collection_name)
+    
+    async def list_snapshots(self):
+        """Listar snapshots de la colección"""
+        return await self.client.list_snapshots(collection_name=self.collection_name)
+    
+    async def delete_snapshot(self, snapshot_name: str):
+        """Eliminar snapshot de la colección en el servidor"""
+        await self.client.delete_snapshot(
+            collection_name=self.collection_name,
+            snapshot_name=snapshot_name
+        )
+    
+    async def download_snapshot(self, snapshot_name: str, destination: str, chunk_size: int = 1 << 20):
+        """Descargar un snapshot en streaming a un fichero local"""
+        url = f"{settings.qdrant_url}/collections/{self.collection_name}/snapshots/{snapshot_name}"
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                with open(destination, "wb") as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
     
     async def get_collection_info(self) -> Dict[str, Any]:
-        """Obtener información de la colección"""
+        """Obtener información de la colección (cacheada COLLECTION_INFO_TTL segundos)"""
+        now = time.monotonic()
+        cached = self._collection_info_cache.get(self.collection_name)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        
         try:
             info = await self.client.get_collection(self.collection_name)
-            return {
+            result = {
                 "name": self.collection_name,
                 "status": info.status,
                 "vectors_count": info.vectors_count,
                 "indexed_vectors_count": info.indexed_vectors_count,
                 "points_count": info.points_count
             }
+            # Solo se cachean respuestas correctas: un error se vuelve a comprobar
+            self._collection_info_cache[self.collection_name] = (now + COLLECTION_INFO_TTL, result)
+            return result
         except Exception as e:
             logger.error(f"Error getting collection info: {e}")
             return {"error": str(e)}
@@ -7,9 +7,10 @@ import json
 import uuid
 from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select
 from qdrant_client.models import PointStruct
 
+from config import settings
 from db.models import Document, Chunk, Tenant
 from models.schemas import DocumentIngest, DocumentMetadata, DocumentStructured, DocumentResponse
 from services.embeddings import EmbeddingService, QdrantService
@@ -29,19 +30,19 @@ class MetadataExtractor:
     Z_OBJECT_PATTERN = re.compile(r'\b[ZY][A-Z0-9_]{2,}\b')
     
     # Lista blanca de t-codes IS-U comunes
-    ISU_TCODES = {
+    ISU_TCODES = frozenset({
         'EC85', 'EC86', 'EC87', 'EC01', 'EC02', 'EC03', 'EC10', 'EC11',
         'ES21', 'ES22', 'ES23', 'ES31', 'ES32', 'ES33', 'ES41', 'ES42',
         'EL31', 'EL32', 'EL33', 'EL34', 'EL35', 'EL36', 'EL37', 'EL38',
         'EABL', 'EABLG', 'EORD', 'EORDG', 'EVER', 'EVERG', 'EANL', 'EANLG'
-    }
+    })
     
     # Lista de tablas IS-U comunes
-    ISU_TABLES = {
+    ISU_TABLES = frozenset({
         'EABLG', 'EABL', 'EORDG', 'EORD', 'EVERG', 'EVER', 'EANLG', 'EANL',
         'BUT000', 'BUT020', 'ADRC', 'FKKVKP', 'FKKVK', 'ERCH', 'ERCHC',
         'DFKKKO', 'DFKKOP', 'EUITRANS', 'ESERVPROV', 'TE410', 'TE416'
-    }
+    })
     
     # Mapeo de temas por t-codes
     TOPIC_MAPPING = {
@@ -53,19 +54,38 @@ class MetadataExtractor:
         'contracts': ['EC01', 'EC02', 'EC03', 'EC10']
     }
     
+    # Palabras clave por tema, en orden de prioridad
+    TOPIC_KEYWORDS = (
+        ('billing', ('factura', 'billing', 'lectura', 'consumo')),
+        ('move-in', ('alta', 'move-in', 'conexion', 'suministro')),
+        ('move-out', ('baja', 'move-out', 'desconexion')),
+        ('device-management', ('aparato', 'device', 'contador', 'medidor')),
+        ('dunning', ('reclamacion', 'dunning', 'impago')),
+        ('contracts', ('contrato', 'contract')),
+    )
+    
+    # Una sola pasada sobre el texto: la lookahead prueba cada posición, así que
+    # palabras solapadas ('conexion' dentro de 'desconexion') se siguen detectando
+    TOPIC_KEYWORD_PATTERN = re.compile(
+        '(?=' + '|'.join(
+            f"(?P<t{rank}>{'|'.join(map(re.escape, words))})"
+            for rank, (_, words) in enumerate(TOPIC_KEYWORDS)
+        ) + ')'
+    )
+    
     @classmethod
     def extract_tcodes(cls, text: str) -> List[str]:
         """Extraer t-codes del texto"""
         found_tcodes = cls.TCODE_PATTERN.findall(text.upper())
         # Filtrar solo t-codes IS-U conocidos
-        return list(set(tcode for tcode in found_tcodes if tcode in cls.ISU_TCODES))
+        return list({tcode for tcode in found_tcodes if tcode in cls.ISU_TCODES})
     
     @classmethod
     def extract_tables(cls, text: str) -> List[str]:
         """Extraer tablas del texto"""
         found_tables = cls.TABLE_PATTERN.findall(text.upper())
         # Filtrar solo tablas IS-U conocidas
-        return list(set(table for table in found_tables if table in cls.ISU_TABLES))
+        return list({table for table in found_tables if table in cls.ISU_TABLES})
     
     @classmethod
     def detect_z_objects(cls, text: str) -> List[str]:
@@ -75,28 +95,21 @@ class MetadataExtractor:
     @classmethod
     def infer_topic(cls, tcodes: List[str], tables: List[str], text: str) -> Optional[str]:
         """Inferir tema basado en t-codes, tablas y contenido"""
-        text_lower = text.lower()
-        
         # Buscar por t-codes
         for topic, topic_tcodes in cls.TOPIC_MAPPING.items():
             if any(tcode in tcodes for tcode in topic_tcodes):
                 return topic
         
-        # Buscar por palabras clave en texto
-        if any(word in text_lower for word in ['factura', 'billing', 'lectura', 'consumo']):
-            return 'billing'
-        elif any(word in text_lower for word in ['alta', 'move-in', 'conexion', 'suministro']):
-            return 'move-in'
-        elif any(word in text_lower for word in ['baja', 'move-out', 'desconexion']):
-            return 'move-out'
-        elif any(word in text_lower for word in ['aparato', 'device', 'contador', 'medidor']):
-            return 'device-management'
-        elif any(word in text_lower for word in ['reclamacion', 'dunning', 'impago']):
-            return 'dunning'
-        elif any(word in text_lower for word in ['contrato', 'contract']):
-            return 'contracts'
+        # Buscar por palabras clave en texto; gana el tema de mayor prioridad
+        best_rank = None
+        for match in cls.TOPIC_KEYWORD_PATTERN.finditer(text.lower()):
+            rank = int(match.lastgroup[1:])
+            if best_rank is None or rank < best_rank:
+                best_rank = rank
+                if rank == 0:
+                    break
         
-        return None
+        return cls.TOPIC_KEYWORDS[best_rank][0] if best_rank is not None else None
     
     @classmethod
     def infer_system(cls, tcodes: List[str], tables: List[str]) -> Optional[str]:
@@ -391,21 +404,22 @@ class DocumentProcessor:
                 }
             ))
             
-            # Registro para Postgres
-            chunk_records.append(Chunk(
-                id=uuid.UUID(chunk_id),
-                document_id=document.id,
-                chunk_index=chunk_data['index'],
-                content=chunk_data['content'],
-                token_count=chunk_data['token_count'],
-                qdrant_point_id=point_id
-            ))
+            # Fila para Postgres
+            chunk_records.append({
+                "id": uuid.UUID(chunk_id),
+                "document_id": document.id,
+                "chunk_index": chunk_data['index'],
+                "content": chunk_data['content'],
+                "token_count": chunk_data['token_count'],
+                "qdrant_point_id": point_id
+            })
         
         # Insertar en Qdrant
         await self.qdrant_service.upsert_points(qdrant_points)
         
-        # Insertar chunks en Postgres
-        db.add_all(chunk_records)
+        # Insertar chunks en Postgres: un INSERT multi-fila sin instanciar objetos ORM
+        if chunk_records:
+            await db.execute(insert(Chunk), chunk_records)
         await db.commit()
         
         return len(chunk_records)
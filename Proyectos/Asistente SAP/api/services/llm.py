@@ -2,23 +2,91 @@
 Servicio de LLM para estructuración de contenido
 Wiki Inteligente SAP IS-U
 """
+import io
 import json
 import asyncio
-from typing import Optional, Dict, Any
+import logging
+import math
+from typing import Optional, Dict, Any, List
 from openai import AsyncOpenAI
+from tenacity import (
+    retry, retry_if_exception_type, stop_after_attempt, before_sleep_log
+)
 from config import settings
 from models.schemas import DocumentStructured
 from utils.logging import get_logger
+from utils.ratelimit import RateLimiter, RETRYABLE_OPENAI_ERRORS, wait_retry_after
 
 logger = get_logger(__name__)
 
 
+# Prefijos fijos del prompt de resumen. Se mantienen byte a byte idénticos entre
+# llamadas para que OpenAI pueda reutilizar el prefijo cacheado.
+_SUMMARY_INSTRUCTIONS = """IMPORTANTE:
+- Mantén todos los códigos de transacciones SAP (como EL02, EUITRANS, etc.)
+- Conserva números, configuraciones y parámetros técnicos
+- Incluye todos los procedimientos y pasos importantes
+- Mantén la estructura lógica del contenido
+- Usa un formato claro y organizado
+
+Crea un {summary_type} del siguiente contenido, manteniendo toda la información técnica importante, números de transacciones, códigos, configuraciones y detalles relevantes.
+
+Contenido a resumir:"""
+
+_SUMMARY_PREFIX_DETAILED = _SUMMARY_INSTRUCTIONS.format(summary_type="resumen detallado")
+_SUMMARY_PREFIX_FINAL = _SUMMARY_INSTRUCTIONS.format(summary_type="resumen final conciso")
+
+# Limitador compartido por todas las instancias del servicio
+_rate_limiter = RateLimiter(rpm=settings.openai_rpm, tpm=settings.openai_tpm)
+
+
+# Fronteras preferidas para cortar contenido largo, de mayor a menor prioridad
+_SPLIT_BOUNDARIES = ("\n\n--- ", "\n\n", ". ")
+
+
+def _split_on_boundaries(content: str, max_size: int, boundaries=_SPLIT_BOUNDARIES) -> List[str]:
+    """Dividir contenido en piezas de hasta max_size cortando en fronteras naturales"""
+    pieces = []
+    start = 0
+    length = len(content)
+    
+    while length - start > max_size:
+        end = start + max_size
+        cut = -1
+        # Buscar la frontera de mayor prioridad en la segunda mitad de la ventana
+        for boundary in boundaries:
+            pos = content.rfind(boundary, start + max_size // 2, end)
+            if pos != -1:
+                cut = pos + len(boundary) if boundary == ". " else pos
+                break
+        if cut <= start:
+            cut = end
+        pieces.append(content[start:cut])
+        start = cut
+    
+    if start < length:
+        pieces.append(content[start:])
+    
+    # Un resto muy pequeño no merece su propia llamada a la API
+    if len(pieces) >= 2 and len(pieces[-1]) < max_size // 4:
+        tail = pieces.pop()
+        pieces[-1] += tail
+    
+    return pieces
+
+
 class LLMService:
     """Servicio para interacciones con LLM"""
     
+    # Frases de incertidumbre (ya en casefold) y t-codes que indican especificidad
+    _UNCERTAINTY_PHRASES = ('podría', 'posiblemente', 'tal vez', 'no estoy seguro')
+    _SPECIFIC_TCODES = ('EC85', 'ES21', 'EL31', 'EABL')
+    _CONFIDENCE_BASE = 0.85
+    
     def __init__(self):
         self.client = AsyncOpenAI(api_key=settings.openai_api_key)
         self.model = settings.llm_model
+        self.rate_limiter = _rate_limiter
     
     async def extract_structure(self, text: str) -> DocumentStructured:
         """Extraer estructura del texto usando LLM"""
@@ -232,53 +300,58 @@ Formato de respuesta:
             else:
                 # Contenido muy grande, dividir y resumir por partes
                 chunks = []
-                for i in range(0, len(content), max_chunk_size):
-                    chunk = content[i:i + max_chunk_size]
+                for chunk in _split_on_boundaries(content, max_chunk_size):
                     chunk_summary = await self._create_summary(chunk)
                     chunks.append(chunk_summary)
-                
-                # Si hay múltiples resúmenes, combinarlos
-                if len(chunks) > 1:
-                    combined = "\n\n".join(chunks)
-                    # Si el resultado combinado sigue siendo largo, resumir una vez más
-                    if len(combined) > 8000:  # ~2000 tokens
-                        return await self._create_summary(combined, final_summary=True)
-                    return combined
-                else:
+
+                if len(chunks) == 1:
                     return chunks[0]
+
+                # Acumular resúmenes llevando la cuenta de tokens estimados;
+                # solo se paga la pasada final si se supera el presupuesto
+                buffer = io.StringIO()
+                total_tokens = 0
+                for chunk_summary in chunks:
+                    buffer.write(chunk_summary)
+                    buffer.write("\n\n")
+                    total_tokens += len(chunk_summary) // 4
+
+                combined = buffer.getvalue().rstrip()
+                if total_tokens > 2000:  # ~8000 caracteres
+                    return await self._create_summary(combined, final_summary=True)
+                return combined
                     
         except Exception as e:
             logger.error(f"Error creating summary: {e}")
             # Fallback: truncar si el resumen falla
             return content[:8000] + "\n\n[RESUMEN AUTOMÁTICO FALLÓ - CONTENIDO TRUNCADO]"
     
+    @retry(
+        retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS),
+        wait=wait_retry_after,
+        stop=stop_after_attempt(6),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True
+    )
     async def _create_summary(self, content: str, final_summary: bool = False) -> str:
         """Crear un resumen de contenido específico"""
-        summary_type = "resumen final conciso" if final_summary else "resumen detallado"
+        prefix = _SUMMARY_PREFIX_FINAL if final_summary else _SUMMARY_PREFIX_DETAILED
+        max_tokens = 1500 if final_summary else 2000
         
-        summary_prompt = f"""Crea un {summary_type} del siguiente contenido, manteniendo toda la información técnica importante, números de transacciones, códigos, configuraciones y detalles relevantes.
-
-IMPORTANTE:
-- Mantén todos los códigos de transacciones SAP (como EL02, EUITRANS, etc.)
-- Conserva números, configuraciones y parámetros técnicos
-- Incluye todos los procedimientos y pasos importantes
-- Mantén la estructura lógica del contenido
-- Usa un formato claro y organizado
-
-Contenido a resumir:
-{content}
-
-Resumen:"""
+        await self.rate_limiter.acquire((len(prefix) + len(content)) // 4 + max_tokens)
 
         try:
-            response = await self.client.chat.completions.create(
+            raw_response = await self.client.chat.completions.with_raw_response.create(
                 model=self.model,
                 messages=[
-                    {"role": "user", "content": summary_prompt}
+                    {"role": "system", "content": prefix},
+                    {"role": "user", "content": content + "\n\nResumen:"}
                 ],
                 temperature=0.1,  # Baja temperatura para consistencia
-                max_tokens=1500 if final_summary else 2000
+                max_tokens=max_tokens
             )
+            self.rate_limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
             
             summary = response.choices[0].message.content
             return f"[RESUMEN AUTOMÁTICO]\n{summary}"
@@ -306,15 +379,18 @@ Resumen:"""
         
         # 3. Si contiene t-codes o tablas (más específica)
         specificity_factor = 1.0
-        if any(code in answer.upper() for code in ['EC85', 'ES21', 'EL31', 'EABL']):
+        answer_upper = answer.upper()
+        if any(code in answer_upper for code in self._SPECIFIC_TCODES):
             specificity_factor = 1.2
         
         # 4. Si admite incertidumbre ("podría", "posiblemente")
-        uncertainty_phrases = ['podría', 'posiblemente', 'tal vez', 'no estoy seguro']
-        if any(phrase in answer.lower() for phrase in uncertainty_phrases):
+        answer_folded = answer.casefold()
+        if any(phrase in answer_folded for phrase in self._UNCERTAINTY_PHRASES):
             uncertainty_factor = 0.7
         else:
             uncertainty_factor = 1.0
         
-        confidence = (chunk_factor * length_factor * specificity_factor * uncertainty_factor) * 0.85
-        return min(max(confidence, 0.0), 1.0)
+        confidence = self._CONFIDENCE_BASE * math.prod(
+            (chunk_factor, length_factor, specificity_factor, uncertainty_factor)
+        )
+        return 0.0 if confidence < 0.0 else (1.0 if confidence > 1.0 else confidence)
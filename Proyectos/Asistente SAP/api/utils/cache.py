@@ -0,0 +1,133 @@
+"""
+Caché de resultados de búsqueda vectorial en Redis
+Wiki Inteligente SAP IS-U
+"""
+import hashlib
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import orjson
+
+from config import settings
+from utils.logging import get_logger
+
+# Redis es opcional: sin él la caché queda desactivada
+try:
+    import redis.asyncio as redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = get_logger(__name__)
+
+KEY_PREFIX = "qdrs:"
+# Generación por tenant (y una global): escribir en Qdrant la incrementa, las claves
+# viejas dejan de consultarse y caducan solas por TTL
+GENERATION_PREFIX = f"{KEY_PREFIX}gen:"
+ALL_TENANTS = "*"
+
+# Cliente Redis único por proceso (y su pool de conexiones), creado al primer uso
+_client = None
+
+
+def _get_client():
+    """Cliente Redis compartido, o None si la caché está desactivada"""
+    global _client
+    if _client is None and REDIS_AVAILABLE and settings.redis_url:
+        _client = redis.from_url(settings.redis_url)
+    return _client
+
+
+class SearchCache:
+    """Caché de resultados de Qdrant con TTL corto, clave = hash(vector, filtros, top_k)"""
+
+    def __init__(self, ttl: int = None):
+        self.ttl = ttl or settings.search_cache_ttl
+        self.client = _get_client()
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def make_key(
+        self,
+        query_vector: List[float],
+        tenant_filter: List[str],
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        payload_fields: Optional[List[str]] = None,
+        generations: Sequence[int] = ()
+    ) -> str:
+        """Clave estable para una búsqueda"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(struct.pack(f"{len(query_vector)}f", *query_vector))
+        digest.update(orjson.dumps(
+            [sorted(tenant_filter), top_k, filters or {}, sorted(payload_fields or []), list(generations)],
+            option=orjson.OPT_SORT_KEYS
+        ))
+        return f"{KEY_PREFIX}{digest.hexdigest()}"
+
+    async def make_keys(
+        self,
+        query_vectors: List[List[float]],
+        tenant_filters: List[List[str]],
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        payload_fields: Optional[List[str]] = None
+    ) -> List[str]:
+        """Claves de varias búsquedas con la generación vigente de sus tenants"""
+        tenants = sorted({tenant for tenant_filter in tenant_filters for tenant in tenant_filter})
+        current = dict.fromkeys([ALL_TENANTS, *tenants], 0)
+
+        if self.enabled:
+            try:
+                values = await self.client.mget([f"{GENERATION_PREFIX}{tenant}" for tenant in current])
+                current = {tenant: int(value or 0) for tenant, value in zip(current, values)}
+            except Exception as e:
+                logger.warning(f"Search cache unavailable: {e}")
+
+        return [
+            self.make_key(
+                query_vector, tenant_filter, top_k, filters, payload_fields,
+                generations=[current[ALL_TENANTS], *(current[tenant] for tenant in sorted(tenant_filter))]
+            )
+            for query_vector, tenant_filter in zip(query_vectors, tenant_filters)
+        ]
+
+    async def get_many(self, keys: List[str]) -> List[Optional[List[Dict[str, Any]]]]:
+        """Resultados cacheados (None si no hay) para cada clave"""
+        if not self.enabled or not keys:
+            return [None] * len(keys)
+
+        try:
+            values = await self.client.mget(keys)
+            return [orjson.loads(value) if value is not None else None for value in values]
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {e}")
+            return [None] * len(keys)
+
+    async def set_many(self, items: Dict[str, List[Dict[str, Any]]]):
+        """Guardar resultados con TTL"""
+        if not self.enabled or not items:
+            return
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, results in items.items():
+                    pipe.setex(key, self.ttl, orjson.dumps(results))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {e}")
+
+    async def invalidate(self, tenants: Optional[Iterable[str]] = None):
+        """Invalidar resultados tras escribir en Qdrant (sin tenants: los de todos)"""
+        if not self.enabled:
+            return
+
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for tenant in set(tenants) if tenants is not None else (ALL_TENANTS,):
+                    pipe.incr(f"{GENERATION_PREFIX}{tenant}")
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Search cache unavailable: {e}")
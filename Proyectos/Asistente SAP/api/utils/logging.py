@@ -4,13 +4,26 @@ Wiki Inteligente SAP IS-U
 """
 import logging
 import sys
+from contextlib import contextmanager
 from typing import Any, Dict
+import orjson
 import structlog
 from config import settings
 
 
 def configure_logging():
     """Configurar logging estructurado"""
+    log_level = getattr(logging, settings.log_level.upper())
+    
+    # En formato JSON se serializa con orjson y se escriben bytes directamente,
+    # evitando el paso intermedio por str
+    if settings.log_format == "json":
+        renderer = structlog.processors.JSONRenderer(serializer=orjson.dumps)
+        logger_factory = structlog.BytesLoggerFactory()
+    else:
+        renderer = structlog.dev.ConsoleRenderer()
+        logger_factory = structlog.PrintLoggerFactory()
+    
     # Configurar structlog
     structlog.configure(
         processors=[
@@ -18,19 +31,16 @@ def configure_logging():
             structlog.processors.add_log_level,
             structlog.processors.StackInfoRenderer(),
             structlog.dev.set_exc_info,
-            structlog.processors.JSONRenderer() if settings.log_format == "json" 
-            else structlog.dev.ConsoleRenderer()
+            renderer
         ],
-        wrapper_class=structlog.make_filtering_bound_logger(
-            getattr(logging, settings.log_level.upper())
-        ),
-        logger_factory=structlog.PrintLoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(log_level),
+        logger_factory=logger_factory,
         cache_logger_on_first_use=True,
     )
     
     # Configurar logging estándar
     logging.basicConfig(
-        level=getattr(logging, settings.log_level.upper()),
+        level=log_level,
         format="%(message)s",
         stream=sys.stdout,
     )
@@ -41,13 +51,17 @@ def get_logger(name: str = None) -> structlog.BoundLogger:
     return structlog.get_logger(name)
 
 
-def add_request_context(request_id: str, user_id: str = None, tenant: str = None):
-    """Añadir contexto de request a logs"""
+@contextmanager
+def request_context(request_id: str, user_id: str = None, tenant: str = None):
+    """Añadir contexto de request a logs durante el bloque"""
     context = {"request_id": request_id}
     if user_id:
         context["user_id"] = user_id
     if tenant:
         context["tenant"] = tenant
     
-    structlog.contextvars.clear_contextvars()
-    structlog.contextvars.bind_contextvars(**context)
+    tokens = structlog.contextvars.bind_contextvars(**context)
+    try:
+        yield
+    finally:
+        structlog.contextvars.reset_contextvars(**tokens)
@@ -33,17 +33,6 @@ logger = logging.getLogger(__name__)
 class FileParser:
     """Parser para diferentes tipos de archivos"""
     
-    SUPPORTED_EXTENSIONS = {
-        '.pdf': 'parse_pdf',
-        '.docx': 'parse_docx', 
-        '.doc': 'parse_docx',
-        '.md': 'parse_markdown',
-        '.markdown': 'parse_markdown',
-        '.html': 'parse_html',
-        '.htm': 'parse_html',
-        '.txt': 'parse_text'
-    }
-    
     def parse_file(self, file_path: str, content_type: str = None) -> Dict[str, Any]:
         """Parsear archivo y extraer texto"""
         if not os.path.exists(file_path):
@@ -52,13 +41,12 @@ class FileParser:
         # Detectar tipo por extensión
         extension = Path(file_path).suffix.lower()
         
-        if extension not in self.SUPPORTED_EXTENSIONS:
+        parser_method = self.SUPPORTED_EXTENSIONS.get(extension)
+        if parser_method is None:
             raise ValueError(f"Unsupported file type: {extension}")
         
-        parser_method = getattr(self, self.SUPPORTED_EXTENSIONS[extension])
-        
         try:
-            result = parser_method(file_path)
+            result = parser_method(self, file_path)
             result['file_type'] = extension
             result['file_size'] = os.path.getsize(file_path)
             return result
@@ -196,6 +184,18 @@ class FileParser:
         except Exception as e:
             raise ValueError(f"Failed to parse text file: {str(e)}")
     
+    # Despacho directo extensión -> método parser (definido tras los métodos)
+    SUPPORTED_EXTENSIONS = {
+        '.pdf': parse_pdf,
+        '.docx': parse_docx,
+        '.doc': parse_docx,
+        '.md': parse_markdown,
+        '.markdown': parse_markdown,
+        '.html': parse_html,
+        '.htm': parse_html,
+        '.txt': parse_text
+    }
+    
     @classmethod
     def get_supported_extensions(cls) -> list:
         """Obtener lista de extensiones soportadas"""
@@ -0,0 +1,92 @@
+"""
+Limitador de ritmo para llamadas a APIs externas
+Wiki Inteligente SAP IS-U
+"""
+import asyncio
+import time
+from typing import Mapping
+
+import openai
+from tenacity import wait_exponential_jitter
+
+
+# Errores transitorios de OpenAI que merece la pena reintentar
+RETRYABLE_OPENAI_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_exponential_wait = wait_exponential_jitter(initial=1, max=30)
+
+
+def wait_retry_after(retry_state) -> float:
+    """Esperar lo indicado por la cabecera retry-after, o backoff exponencial"""
+    exc = retry_state.outcome.exception()
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), 30.0)
+            except ValueError:
+                pass
+    return _exponential_wait(retry_state)
+
+
+class RateLimiter:
+    """Token bucket que limita peticiones (RPM) y tokens (TPM) por minuto"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Rellenar los buckets según el tiempo transcurrido"""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, est_tokens: int):
+        """Esperar hasta que haya capacidad para una petición de est_tokens"""
+        est_tokens = min(est_tokens, self.tpm)
+
+        # El lock mantiene el orden de llegada entre tareas concurrentes
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= est_tokens:
+                    self._requests -= 1
+                    self._tokens -= est_tokens
+                    return
+
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm,
+                    (est_tokens - self._tokens) * 60 / self.tpm,
+                    0.01
+                )
+                await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Ajustar los buckets con los límites restantes que informa el proveedor"""
+        self._refill()
+
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests:
+            try:
+                self._requests = min(self._requests, float(remaining_requests))
+            except ValueError:
+                pass
+
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens:
+            try:
+                self._tokens = min(self._tokens, float(remaining_tokens))
+            except ValueError:
+                pass
@@ -2,10 +2,83 @@
 # ESTRUCTURA RECOMENDADA PARA ORGANIZAR CONOCIMIENTO SAP IS-U
 # ====================================================================
 
+import bisect
+import functools
+import itertools
+import re
+import string
+import sys
+import types
+import unicodedata
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+
+try:
+    import marisa_trie
+    MARISA_AVAILABLE = True
+except ImportError:
+    MARISA_AVAILABLE = False
+
+# Centinelas de scope internados: se pueden comparar por identidad
+STANDARD = sys.intern("STANDARD")
+CLIENT_SPECIFIC = sys.intern("CLIENT_SPECIFIC")
+
+# Las plantillas de formato viven en docs/templates/<clave>.txt y se cargan
+# bajo demanda: importar el módulo no lee ninguna
+_TEMPLATES_DIR = Path(__file__).parent / "templates"
+
+
+@functools.cache
+def _load_format(key: str) -> str:
+    """Leer (una sola vez) la plantilla de formato de una categoría"""
+    return sys.intern((_TEMPLATES_DIR / f"{key}.txt").read_text(encoding="utf-8"))
+
+
+# Placeholders del tipo [NOMBRE] que se pueden rellenar (mayúsculas, con tildes
+# como [TÍTULO]); los descriptivos ([Descripción corta], [Lista]...) se dejan tal cual
+_PLACEHOLDER_RE = re.compile(r"\[([A-ZÁÉÍÓÚÜÑ_]+)\]")
+
+
+@functools.cache
+def _template_field(name: str) -> str:
+    """Nombre ASCII para string.Template: TÍTULO -> TITULO"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+@functools.cache
+def _compile_format(key: str) -> string.Template:
+    """Convertir una plantilla [NOMBRE] a string.Template (${NOMBRE}) una sola vez"""
+    text = _load_format(key).replace("$", "$$")
+    return string.Template(
+        _PLACEHOLDER_RE.sub(lambda match: f"${{{_template_field(match.group(1))}}}", text)
+    )
+
+
+@dataclass(slots=True, frozen=True)
+class KnowledgeCategory:
+    """Categoría de conocimiento con sus ejemplos, scope y plantilla de formato"""
+    description: str
+    examples: tuple[str, ...]
+    scope: str
+    format_key: str
+
+    @property
+    def format(self) -> str:
+        """Plantilla de formato, cargada al primer acceso"""
+        return _load_format(self.format_key)
+
+    @property
+    def template(self) -> string.Template:
+        """Plantilla precompilada; rellenar con template.safe_substitute(NOMBRE=...), sin tildes"""
+        return _compile_format(self.format_key)
+
+
 knowledge_structure = {
-    "📊 MASTER_DATA": {
-        "description": "Documentación de tablas principales",
-        "examples": [
+    "📊 MASTER_DATA": KnowledgeCategory(
+        description="Documentación de tablas principales",
+        examples=(
             "BUT000 - Business Partner",
             "EVER - Instalaciones y contratos", 
             "EABL - Documentos de facturación",
@@ -14,287 +87,195 @@ knowledge_structure = {
             "EANLH - Historial de aparatos",
             "ERCH - Cabeceras de factura",
             "DFKKOP - Partidas abiertas FI-CA"
-        ],
-        "scope": "STANDARD",
-        "format": """
-        Tabla: [NOMBRE] - [Descripción corta]
-        ===================================
-        
-        Descripción: [Propósito de la tabla]
-        
-        Campos principales:
-        - CAMPO1: Descripción
-        - CAMPO2: Descripción
-        
-        Relaciones:
-        - TABLA_REL: Via campo X
-        
-        T-codes relacionadas:
-        - TX01: Descripción
-        
-        Validaciones:
-        - Regla 1
-        - Regla 2
-        
-        Errores comunes:
-        - Error: Solución
-        """
-    },
+        ),
+        scope=STANDARD,
+        format_key="master_data"
+    ),
     
-    "🔧 TRANSACTIONS": {
-        "description": "T-codes y transacciones",
-        "examples": [
+    "🔧 TRANSACTIONS": KnowledgeCategory(
+        description="T-codes y transacciones",
+        examples=(
             "EC85 - Facturación manual",
             "ES21 - Alta de instalación",
             "ES31 - Cuentas contractuales",
             "EL31 - Gestión de aparatos",
             "BP - Business Partner",
             "FPL9 - Plan de pagos"
-        ],
-        "scope": "STANDARD", 
-        "format": """
-        T-code: [CODIGO] - [Descripción]
-        ===============================
-        
-        Propósito: [Para qué sirve]
-        Módulo: [IS-U área]
-        
-        Campos obligatorios:
-        - Campo1: Descripción
-        
-        Proceso:
-        1. Paso 1
-        2. Paso 2
-        
-        Validaciones:
-        - Verificación 1
-        
-        Errores frecuentes:
-        - Error: Causa y solución
-        
-        Tablas actualizadas:
-        - TABLA1: Qué actualiza
-        """
-    },
+        ),
+        scope=STANDARD,
+        format_key="transactions"
+    ),
     
-    "🔄 BUSINESS_PROCESSES": {
-        "description": "Procesos de negocio end-to-end",
-        "examples": [
+    "🔄 BUSINESS_PROCESSES": KnowledgeCategory(
+        description="Procesos de negocio end-to-end",
+        examples=(
             "Move-in (Alta de suministro)",
             "Move-out (Baja de suministro)", 
             "Facturación periódica",
             "Gestión de lecturas",
             "Proceso de cobranza",
             "Change of supplier"
-        ],
-        "scope": "STANDARD",
-        "format": """
-        Proceso: [NOMBRE]
-        =================
-        
-        Objetivo: [Meta del proceso]
-        
-        FASE 1: [Nombre fase]
-        --------------------
-        1. Actividad 1
-        2. Actividad 2
-        
-        FASE 2: [Nombre fase]
-        --------------------
-        1. Actividad 1
-        
-        Validaciones críticas:
-        - Validación 1
-        
-        Errores frecuentes:
-        - Error: Solución
-        
-        T-codes: [Lista]
-        Tablas: [Lista]
-        """
-    },
+        ),
+        scope=STANDARD,
+        format_key="business_processes"
+    ),
     
-    "🚨 INCIDENT_SOLUTIONS": {
-        "description": "Soluciones a incidencias técnicas",
-        "examples": [
+    "🚨 INCIDENT_SOLUTIONS": KnowledgeCategory(
+        description="Soluciones a incidencias técnicas",
+        examples=(
             "Error BP no válido en ES21",
             "Factura duplicada en EC85",
             "Aparato no encontrado en EL31",
             "Error de lectura en EABLG",
             "Problemas de autorización",
             "Errores de customizing"
-        ],
-        "scope": "CLIENT_SPECIFIC",  # Pueden ser específicas por cliente
-        "format": """
-        Incidencia: [Descripción del problema]
-        =====================================
-        
-        Síntoma: [Cómo se manifiesta]
-        
-        Causas posibles:
-        1. Causa 1
-        2. Causa 2
-        
-        Diagnóstico:
-        1. Verificar X
-        2. Revisar Y
-        
-        Solución:
-        1. Acción 1
-        2. Acción 2
-        
-        Prevención:
-        - Medida preventiva
-        
-        Severidad: [Alta/Media/Baja]
-        T-codes: [Lista]
-        Tablas: [Lista]
-        """
-    },
+        ),
+        scope=CLIENT_SPECIFIC,  # Pueden ser específicas por cliente
+        format_key="incident_solutions"
+    ),
     
-    "⚙️ CONFIGURATION": {
-        "description": "Customizing y configuración",
-        "examples": [
+    "⚙️ CONFIGURATION": KnowledgeCategory(
+        description="Customizing y configuración",
+        examples=(
             "Configuración de tipos de contrato",
             "Setup de aparatos de medición",
             "Customizing de facturación",
             "Configuración de Business Partner",
             "Setup de rate determination",
             "Configuración de FI-CA"
-        ],
-        "scope": "CLIENT_SPECIFIC",
-        "format": """
-        Configuración: [Área de customizing]
-        ===================================
-        
-        Propósito: [Para qué se configura]
-        
-        Path SPRO: [Ruta en customizing]
-        
-        Pasos de configuración:
-        1. Paso 1
-        2. Paso 2
-        
-        Tablas de customizing:
-        - TABLA1: Qué configura
-        
-        Consideraciones:
-        - Consideración 1
-        
-        Impacto:
-        - En proceso X
-        - En transacción Y
-        """
-    },
+        ),
+        scope=CLIENT_SPECIFIC,
+        format_key="configuration"
+    ),
     
-    "💻 PROGRAMS_REPORTS": {
-        "description": "Programas ABAP y reportes",
-        "examples": [
+    "💻 PROGRAMS_REPORTS": KnowledgeCategory(
+        description="Programas ABAP y reportes",
+        examples=(
             "SAPLIS-U1 - Facturación masiva",
             "RFKKEDR1 - Extracto de cuenta",
             "RFBU0001 - Lista de BP",
             "Programas Z customizados",
             "Reportes de análisis",
             "Jobs de background"
-        ],
-        "scope": "CLIENT_SPECIFIC",
-        "format": """
-        Programa: [NOMBRE] - [Descripción]
-        =================================
-        
-        Tipo: [Report/Function/Class]
-        Propósito: [Para qué sirve]
-        
-        Parámetros principales:
-        - PARAM1: Descripción
-        
-        Funcionalidad:
-        1. Función 1
-        2. Función 2
-        
-        Consideraciones:
-        - Performance
-        - Autorizaciones
-        
-        Scheduling:
-        - Frecuencia recomendada
-        - Variantes útiles
-        """
-    },
+        ),
+        scope=CLIENT_SPECIFIC,
+        format_key="programs_reports"
+    ),
     
-    "📋 FUNCTIONAL_SPECS": {
-        "description": "Especificaciones funcionales",
-        "examples": [
+    "📋 FUNCTIONAL_SPECS": KnowledgeCategory(
+        description="Especificaciones funcionales",
+        examples=(
             "Spec para desarrollo Z",
             "Requirement de interfaz",
             "Especificación de reporte",
             "Documentos de diseño",
             "User stories",
             "Test cases"
-        ],
-        "scope": "CLIENT_SPECIFIC",
-        "format": """
-        Especificación: [TÍTULO]
-        ========================
-        
-        Objetivo: [Meta funcional]
-        
-        Requirements:
-        1. Requirement 1
-        2. Requirement 2
-        
-        Diseño:
-        - Approach técnico
-        
-        Test scenarios:
-        1. Scenario 1
-        2. Scenario 2
-        
-        Dependencies:
-        - Dependencia 1
-        """
-    },
+        ),
+        scope=CLIENT_SPECIFIC,
+        format_key="functional_specs"
+    ),
     
-    "🎓 TRAINING_MATERIALS": {
-        "description": "Material de capacitación",
-        "examples": [
+    "🎓 TRAINING_MATERIALS": KnowledgeCategory(
+        description="Material de capacitación",
+        examples=(
             "Guías de usuario para T-codes",
             "Procedimientos operativos",
             "Manuales de procesos",
             "Casos de uso típicos",
             "Best practices",
             "Tips y trucos"
-        ],
-        "scope": "CLIENT_SPECIFIC",
-        "format": """
-        Guía: [TÍTULO]
-        ==============
-        
-        Audiencia: [Usuario final/Técnico/Funcional]
-        
-        Objetivos de aprendizaje:
-        1. Objetivo 1
-        2. Objetivo 2
-        
-        Procedimiento:
-        1. Paso 1 [Screenshot opcional]
-        2. Paso 2
-        
-        Ejercicios prácticos:
-        - Ejercicio 1
-        
-        Referencias:
-        - Documento relacionado
-        """
-    }
+        ),
+        scope=CLIENT_SPECIFIC,
+        format_key="training_materials"
+    )
 }
 
+# Registro de solo lectura
+knowledge_structure = types.MappingProxyType(knowledge_structure)
+
+
+class Category(IntEnum):
+    """Índice de cada categoría, en el mismo orden que knowledge_structure"""
+    MASTER_DATA = 0
+    TRANSACTIONS = 1
+    BUSINESS_PROCESSES = 2
+    INCIDENT_SOLUTIONS = 3
+    CONFIGURATION = 4
+    PROGRAMS_REPORTS = 5
+    FUNCTIONAL_SPECS = 6
+    TRAINING_MATERIALS = 7
+
+
+# Arrays paralelos indexados por Category; el dict con emojis queda para mostrar
+_SCOPES = tuple(info.scope for info in knowledge_structure.values())
+_FORMAT_KEYS = tuple(info.format_key for info in knowledge_structure.values())
+
+
+# Ejemplos de todas las categorías en una sola tupla + offsets (layout CSR)
+_EXAMPLES = tuple(itertools.chain.from_iterable(
+    info.examples for info in knowledge_structure.values()
+))
+_EXAMPLE_OFFSETS = (0, *itertools.accumulate(
+    len(info.examples) for info in knowledge_structure.values()
+))
+
+
+def scope_of(category: Category) -> str:
+    """Scope de una categoría"""
+    return _SCOPES[category]
+
+
+def format_of(category: Category) -> str:
+    """Plantilla de formato de una categoría"""
+    return _load_format(_FORMAT_KEYS[category])
+
+
+def examples_of(category: Category) -> tuple[str, ...]:
+    """Ejemplos de una categoría"""
+    start, end = _EXAMPLE_OFFSETS[category], _EXAMPLE_OFFSETS[category + 1]
+    return _EXAMPLES[start:end]
+
+
+def render_format(category: Category, **fields: str) -> str:
+    """Rellenar la plantilla de una categoría; los campos que falten se conservan
+
+    Los campos se aceptan con o sin tildes (TÍTULO= o TITULO=).
+    """
+    return _compile_format(_FORMAT_KEYS[category]).safe_substitute(
+        {_template_field(name): value for name, value in fields.items()}
+    )
+
+
+# Índice de nombres (sin emoji) para búsqueda por prefijo
+if MARISA_AVAILABLE:
+    _name_index = marisa_trie.RecordTrie("<B", [(c.name, (c.value,)) for c in Category])
+else:
+    _sorted_names = sorted(c.name for c in Category)
+
+
+def find_category(prefix: str) -> list[Category]:
+    """Categorías cuyo nombre empieza por prefix (p. ej. "TRANSAC")"""
+    prefix = prefix.strip().upper()
+
+    if MARISA_AVAILABLE:
+        return sorted(Category(i) for _, (i,) in _name_index.items(prefix))
+
+    start = bisect.bisect_left(_sorted_names, prefix)
+    matches = []
+    for name in _sorted_names[start:]:
+        if not name.startswith(prefix):
+            break
+        matches.append(Category[name])
+    return sorted(matches)
+
 # ====================================================================
 # COMANDOS PARA ALIMENTAR POR CATEGORÍA
 # ====================================================================
 
+@functools.lru_cache(maxsize=1)
 def get_feeding_examples():
-    """Ejemplos de cómo alimentar cada categoría"""
+    """Ejemplos de cómo alimentar cada categoría (construidos una sola vez, solo lectura)"""
     
     examples = {
         "frontend_web": """
@@ -329,10 +310,13 @@ def get_feeding_examples():
         
         # O alimentar desde directorio
         python -c "
+        import asyncio
         from scripts.feed_knowledge import KnowledgeFeeder
-        feeder = KnowledgeFeeder()
-        feeder.authenticate()
-        feeder.feed_from_files('/path/to/knowledge/docs')
+        async def run():
+            async with KnowledgeFeeder() as feeder:
+                await feeder.authenticate()
+                await feeder.feed_from_files('/path/to/knowledge/docs')
+        asyncio.run(run())
         "
         """,
         
@@ -356,12 +340,12 @@ def get_feeding_examples():
         """
     }
     
-    return examples
+    return types.MappingProxyType(examples)
 
 print("📚 Estructura de conocimiento definida exitosamente!")
 print("\nCategorías disponibles:")
 for category, info in knowledge_structure.items():
-    print(f"  {category}: {info['description']}")
+    print(f"  {category}: {info.description}")
 
 print(f"\n🎯 Total de categorías: {len(knowledge_structure)}")
 print("📖 Ver examples con: get_feeding_examples()")
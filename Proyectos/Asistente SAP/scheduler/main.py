@@ -3,23 +3,46 @@ Scheduler para tareas programadas
 Wiki Inteligente SAP IS-U
 """
 import asyncio
+import hashlib
 import logging
 import os
+import shutil
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+import numpy as np
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 # Añadir el directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
 from api.config import settings
-from api.db.database import AsyncSessionLocal
 from api.utils.logging import configure_logging, get_logger
 
 configure_logging()
 logger = get_logger(__name__)
 
+# Motor propio con pool pequeño: el scheduler comparte Postgres con la API y
+# solo ejecuta un job a la vez
+engine = create_async_engine(
+    settings.database_url,
+    pool_size=settings.scheduler_db_pool_size,
+    max_overflow=settings.scheduler_db_max_overflow,
+    pool_pre_ping=True,
+    pool_recycle=settings.db_pool_recycle
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 
 class BackupService:
     """Servicio de backups"""
@@ -27,34 +50,129 @@ class BackupService:
     async def backup_postgres(self):
         """Backup de PostgreSQL"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = f"/app/backups/postgres_backup_{timestamp}.sql.gz"
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+            backup_file = f"/app/backups/postgres_backup_{timestamp}.sql.zst"
             
             # Crear directorio si no existe
             os.makedirs("/app/backups", exist_ok=True)
             
-            # Comando pg_dump
-            cmd = f"""pg_dump {settings.database_url.replace('+asyncpg', '')} | gzip > {backup_file}"""
+            # Comando pg_dump comprimido con zstd multihilo
+            # (restaurar con: zstd -d --long=27 -c backup.sql.zst | psql ...)
+            cmd = (
+                f"pg_dump {settings.database_url.replace('+asyncpg', '')} "
+                f"| zstd -T0 -3 --long=27 -q -o {backup_file}"
+            )
             
-            result = os.system(cmd)
+            # Subproceso asíncrono: el event loop sigue atendiendo otros jobs
+            proc = await asyncio.create_subprocess_shell(
+                cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
             
-            if result == 0:
+            if proc.returncode == 0:
                 logger.info(f"PostgreSQL backup completed: {backup_file}")
                 
                 # Limpiar backups antiguos (mantener últimos 7 días)
                 await self._cleanup_old_backups("/app/backups", "postgres_backup_", 7)
             else:
-                logger.error(f"PostgreSQL backup failed with code: {result}")
+                logger.error(
+                    f"PostgreSQL backup failed with code {proc.returncode}: "
+                    f"{stderr.decode(errors='replace').strip()}"
+                )
                 
         except Exception as e:
             logger.error(f"Error during PostgreSQL backup: {e}")
     
+    async def backup_pgbackrest(self, backup_type: str = "incr"):
+        """Backup de PostgreSQL con pgBackRest (full o incremental sobre WAL)"""
+        returncode, stderr = await self._run_pgbackrest("backup", f"--type={backup_type}")
+        
+        if returncode == 0:
+            logger.info(f"pgBackRest {backup_type} backup completed")
+        else:
+            logger.error(f"pgBackRest {backup_type} backup failed with code {returncode}: {stderr}")
+    
+    async def backup_postgres_basebackup(self, incremental: bool = True):
+        """Backup físico con pg_basebackup; incremental sobre el último manifest en PG17+"""
+        try:
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+            target_dir = f"/app/backups/postgres_base_{timestamp}"
+            manifests_dir = "/app/backups/manifests"
+            os.makedirs(manifests_dir, exist_ok=True)
+            
+            cmd = [
+                "pg_basebackup",
+                "-d", settings.database_url.replace("+asyncpg", ""),
+                "-D", target_dir,
+                "-Ft", "-Xs", "-z"
+            ]
+            
+            # Solo PostgreSQL 17+ admite --incremental; sin manifest previo se hace full
+            prior_manifest = self._latest_manifest(manifests_dir) if incremental else None
+            if prior_manifest and settings.pg_version >= 17:
+                cmd += ["--incremental", prior_manifest]
+                backup_type = "incremental"
+            else:
+                backup_type = "full"
+            
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
+            
+            if proc.returncode == 0:
+                # Guardar el manifest para encadenar el siguiente incremental
+                await asyncio.to_thread(
+                    shutil.copyfile,
+                    f"{target_dir}/backup_manifest",
+                    f"{manifests_dir}/{timestamp}.backup_manifest"
+                )
+                logger.info(f"PostgreSQL {backup_type} base backup completed: {target_dir}")
+                
+                # Con full semanal, 14 días conservan siempre al menos una cadena completa
+                await self._cleanup_old_backups("/app/backups", "postgres_base_", 14)
+                await self._cleanup_old_backups(manifests_dir, "", 14)
+            else:
+                logger.error(
+                    f"PostgreSQL {backup_type} base backup failed with code {proc.returncode}: "
+                    f"{stderr.decode(errors='replace').strip()}"
+                )
+                
+        except Exception as e:
+            logger.error(f"Error during PostgreSQL base backup: {e}")
+    
+    def _latest_manifest(self, manifests_dir: str):
+        """Ruta del manifest más reciente (los nombres llevan timestamp ordenable)"""
+        manifests = sorted(
+            name for name in os.listdir(manifests_dir) if name.endswith(".backup_manifest")
+        )
+        return os.path.join(manifests_dir, manifests[-1]) if manifests else None
+    
+    async def _run_pgbackrest(self, *args: str):
+        """Ejecutar pgbackrest sin bloquear el event loop"""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "pgbackrest", f"--stanza={settings.pgbackrest_stanza}", *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await proc.communicate()
+            return proc.returncode, stderr.decode(errors="replace").strip()
+            
+        except Exception as e:
+            logger.error(f"Error running pgbackrest: {e}")
+            return -1, str(e)
+    
     async def backup_qdrant(self):
         """Backup de Qdrant"""
         try:
             from api.services.embeddings import QdrantService
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
             backup_dir = f"/app/backups/qdrant_backup_{timestamp}"
             
             # Crear directorio
@@ -62,15 +180,15 @@ class BackupService:
             
             qdrant = QdrantService()
             
-            # Crear snapshot (esto es una simulación, Qdrant real tendría API específica)
-            collection_info = await qdrant.get_collection_info()
+            # Snapshot consistente en el servidor y descarga en streaming
+            snapshot = await qdrant.create_snapshot()
+            snapshot_file = f"{backup_dir}/{qdrant.collection_name}.snapshot"
+            await qdrant.download_snapshot(snapshot.name, snapshot_file)
             
-            # Guardar información de la colección
-            with open(f"{backup_dir}/collection_info.json", "w") as f:
-                import json
-                json.dump(collection_info, f, indent=2)
+            logger.info(f"Qdrant backup completed: {snapshot_file}")
             
-            logger.info(f"Qdrant backup completed: {backup_dir}")
+            # Expirar snapshots antiguos en el servidor
+            await self._cleanup_old_qdrant_snapshots(qdrant, 7)
             
             # Limpiar backups antiguos
             await self._cleanup_old_backups("/app/backups", "qdrant_backup_", 7)
@@ -78,27 +196,78 @@ class BackupService:
         except Exception as e:
             logger.error(f"Error during Qdrant backup: {e}")
     
-    async def _cleanup_old_backups(self, backup_dir: str, prefix: str, days_to_keep: int):
-        """Limpiar backups antiguos"""
+    async def _cleanup_old_qdrant_snapshots(self, qdrant, days_to_keep: int):
+        """Eliminar del servidor Qdrant los snapshots más antiguos que days_to_keep"""
         try:
-            cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_to_keep)
             
-            for item in os.listdir(backup_dir):
-                if item.startswith(prefix):
-                    item_path = os.path.join(backup_dir, item)
-                    item_time = datetime.fromtimestamp(os.path.getmtime(item_path))
+            for snapshot in await qdrant.list_snapshots():
+                if not snapshot.creation_time:
+                    continue
+                
+                created = datetime.fromisoformat(snapshot.creation_time)
+                if created.tzinfo is None:
+                    created = created.replace(tzinfo=timezone.utc)
+                
+                if created < cutoff_date:
+                    await qdrant.delete_snapshot(snapshot.name)
+                    logger.info(f"Removed old Qdrant snapshot: {snapshot.name}")
                     
-                    if item_time < cutoff_date:
-                        if os.path.isfile(item_path):
-                            os.remove(item_path)
-                        elif os.path.isdir(item_path):
-                            import shutil
-                            shutil.rmtree(item_path)
-                        
-                        logger.info(f"Removed old backup: {item}")
-                        
+        except Exception as e:
+            logger.error(f"Error cleaning up old Qdrant snapshots: {e}")
+    
+    async def _cleanup_old_backups(self, backup_dir: str, prefix: str, days_to_keep: int):
+        """Limpiar backups antiguos"""
+        try:
+            # El recorrido del sistema de ficheros es bloqueante: va a un hilo
+            await asyncio.to_thread(self._remove_old_backups, backup_dir, prefix, days_to_keep)
         except Exception as e:
             logger.error(f"Error cleaning up old backups: {e}")
+    
+    def _remove_old_backups(self, backup_dir: str, prefix: str, days_to_keep: int):
+        """Borrar (de forma síncrona) los backups más antiguos que days_to_keep"""
+        cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+        
+        for item in os.listdir(backup_dir):
+            if item.startswith(prefix):
+                item_path = os.path.join(backup_dir, item)
+                item_time = datetime.fromtimestamp(os.path.getmtime(item_path))
+                
+                if item_time < cutoff_date:
+                    if os.path.isfile(item_path):
+                        os.remove(item_path)
+                    elif os.path.isdir(item_path):
+                        shutil.rmtree(item_path)
+                    
+                    logger.info(f"Removed old backup: {item}")
+
+
+def ranking_metrics(retrieved_per_query, expected_sets, k: int = 5):
+    """nDCG@k y Hit@k medios, vectorizados sobre todas las queries
+    
+    expected_sets son los documentos esperados de cada query ya como frozenset,
+    para que cada comprobación de pertenencia sea O(1).
+    """
+    if not retrieved_per_query:
+        return 0.0, 0.0
+    
+    # Matriz (N, k) de relevancia binaria; las filas cortas se rellenan con 0.
+    # Varios chunks del mismo documento cuentan una sola vez (primera posición),
+    # si no el DCG superaría al ideal y nDCG pasaría de 1
+    rel = np.zeros((len(retrieved_per_query), k), dtype=np.float32)
+    for row, (retrieved, expected) in enumerate(zip(retrieved_per_query, expected_sets)):
+        top_docs = list(dict.fromkeys(retrieved))[:k]
+        rel[row, :len(top_docs)] = [doc in expected for doc in top_docs]
+    
+    discount = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = rel @ discount
+    
+    # DCG ideal: todos los documentos esperados (hasta k) en las primeras posiciones
+    ideal_hits = np.array([min(len(expected), k) for expected in expected_sets])
+    ideal_dcg = np.concatenate(([0.0], np.cumsum(discount)))[ideal_hits]
+    ndcg = np.divide(dcg, ideal_dcg, out=np.zeros_like(dcg), where=ideal_dcg > 0)
+    
+    return float(ndcg.mean()), float(rel.any(axis=1).mean())
 
 
 class EvaluationService:
@@ -123,57 +292,47 @@ class EvaluationService:
                 
                 logger.info(f"Running evaluation on {len(eval_queries)} queries")
                 
+                # Documentos esperados materializados una sola vez como conjuntos
+                expected_sets = [frozenset(query.expected_sources or ()) for query in eval_queries]
+                
                 embedding_service = EmbeddingService()
                 qdrant_service = QdrantService()
                 
-                total_ndcg = 0
-                total_hit_at_5 = 0
                 response_times = []
                 
+                # Filtro de tenant por query
+                tenant_filters = []
                 for query in eval_queries:
-                    try:
-                        start_time = datetime.now()
-                        
-                        # Obtener embedding
-                        query_embedding = await embedding_service.get_embedding(query.question)
-                        
-                        # Buscar
-                        tenant_filter = [query.tenant_slug]
-                        if query.tenant_slug != "STANDARD":
-                            tenant_filter.append("STANDARD")
-                        
-                        results = await qdrant_service.search(
-                            query_vector=query_embedding,
-                            tenant_filter=tenant_filter,
-                            top_k=5
-                        )
-                        
-                        # Calcular métricas
-                        retrieved_docs = [r["payload"].get("doc_id") for r in results if r["payload"].get("doc_id")]
-                        expected_docs = query.expected_sources
-                        
-                        # Hit@5
-                        hit_at_5 = 1 if any(doc in retrieved_docs for doc in expected_docs) else 0
-                        total_hit_at_5 += hit_at_5
-                        
-                        # nDCG@5 (simplificado)
-                        ndcg = 0
-                        for i, doc_id in enumerate(retrieved_docs[:5]):
-                            if doc_id in expected_docs:
-                                ndcg += 1 / (i + 1)  # Simplificado
-                        
-                        total_ndcg += ndcg
-                        
-                        # Tiempo de respuesta
-                        response_time = (datetime.now() - start_time).total_seconds() * 1000
-                        response_times.append(response_time)
-                        
-                    except Exception as e:
-                        logger.error(f"Error evaluating query {query.id}: {e}")
-                
-                # Calcular promedios
-                avg_ndcg = total_ndcg / len(eval_queries) if eval_queries else 0
-                avg_hit_at_5 = total_hit_at_5 / len(eval_queries) if eval_queries else 0
+                    tenant_filter = [query.tenant_slug]
+                    if query.tenant_slug != "STANDARD":
+                        tenant_filter.append("STANDARD")
+                    tenant_filters.append(tenant_filter)
+                
+                # Un único lote de embeddings y una única búsqueda batch en Qdrant
+                start_time = perf_counter()
+                
+                query_embeddings = await self._get_cached_embeddings(
+                    db, embedding_service, [query.question for query in eval_queries]
+                )
+                # SearchRequest valida List[float]: conversión única en la frontera
+                batch_results = await qdrant_service.search_batch(
+                    query_vectors=[vector.tolist() for vector in query_embeddings],
+                    tenant_filters=tenant_filters,
+                    top_k=5
+                )
+                
+                # Tiempo de respuesta medio por query dentro del lote
+                batch_time = (perf_counter() - start_time) * 1000
+                response_times.append(batch_time / len(eval_queries))
+                
+                retrieved_per_query = [
+                    [r["payload"].get("doc_id") for r in results if r["payload"].get("doc_id")]
+                    for results in batch_results
+                ]
+                avg_ndcg, avg_hit_at_5 = ranking_metrics(
+                    retrieved_per_query,
+                    expected_sets
+                )
                 avg_response_time = sum(response_times) / len(response_times) if response_times else 0
                 
                 # Guardar resultados
@@ -196,46 +355,171 @@ class EvaluationService:
                 
         except Exception as e:
             logger.error(f"Error during evaluation: {e}")
+    
+    async def _get_cached_embeddings(self, db, embedding_service, texts):
+        """Embeddings (arrays float32) desde la caché por hash del texto; solo se piden los que faltan"""
+        from sqlalchemy import select
+        from api.db.models import EmbeddingCache
+        
+        model = settings.embedding_model
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=settings.embedding_cache_ttl_days)
+        
+        stmt = select(EmbeddingCache).where(
+            EmbeddingCache.text_hash.in_(set(hashes)),
+            EmbeddingCache.model == model,
+            EmbeddingCache.created_at >= cutoff
+        )
+        result = await db.execute(stmt)
+        cached = {
+            row.text_hash: np.frombuffer(row.vector, dtype="<f4")
+            for row in result.scalars().all()
+        }
+        
+        # Textos no cacheados (o caducados), sin duplicados
+        missing = {h: text for h, text in zip(hashes, texts) if h not in cached}
+        if missing:
+            vectors = await embedding_service.get_embeddings(list(missing.values()))
+            for text_hash, vector in zip(missing, vectors):
+                vector = np.asarray(vector, dtype="<f4")
+                cached[text_hash] = vector
+                await db.merge(EmbeddingCache(
+                    text_hash=text_hash,
+                    model=model,
+                    vector=vector.tobytes(),
+                    created_at=now
+                ))
+        
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return [cached[h] for h in hashes]
+
+
+# Jobs a nivel de módulo: el jobstore persistente guarda una referencia
+# textual al callable, y los métodos de instancia no se pueden serializar
+async def run_postgres_backup():
+    await BackupService().backup_postgres()
+
+
+async def run_pgbackrest_backup(backup_type: str):
+    await BackupService().backup_pgbackrest(backup_type)
+
+
+async def run_basebackup(incremental: bool):
+    await BackupService().backup_postgres_basebackup(incremental)
+
+
+async def run_qdrant_backup():
+    await BackupService().backup_qdrant()
+
+
+async def run_weekly_evaluation():
+    await EvaluationService().run_evaluation()
 
 
 async def main():
     """Función principal del scheduler"""
     logger.info("Starting SAP IS-U Wiki Scheduler")
     
-    # Crear servicios
-    backup_service = BackupService()
-    eval_service = EvaluationService()
+    # Jobstore en PostgreSQL (driver síncrono): los jobs sobreviven a reinicios
+    # y los disparos perdidos durante una caída se detectan como misfire
+    jobstore_url = settings.database_url.replace("+asyncpg", "+psycopg")
     
-    # Crear scheduler
-    scheduler = AsyncIOScheduler()
+    # Crear scheduler. Todos los jobs son corrutinas: el AsyncIOExecutor los
+    # ejecuta en paralelo sobre el mismo loop (los dumps corren en subprocesos)
+    scheduler = AsyncIOScheduler(
+        jobstores={"default": SQLAlchemyJobStore(
+            url=jobstore_url,
+            engine_options={"pool_size": 2, "max_overflow": 0}
+        )},
+        executors={"default": AsyncIOExecutor()},
+        job_defaults={
+            "max_instances": 1,
+            "misfire_grace_time": 300,
+            "coalesce": True
+        }
+    )
     
     # Configurar trabajos
     if settings.backup_enabled:
-        # Backup diario a las 2 AM
-        scheduler.add_job(
-            backup_service.backup_postgres,
-            CronTrigger.from_crontab(settings.backup_schedule_cron),
-            id="postgres_backup",
-            name="PostgreSQL Backup"
-        )
+        if settings.backup_method == "pgbackrest":
+            # Full semanal + incremental diario; la expiración la gestiona
+            # pgBackRest con repo1-retention-full
+            scheduler.add_job(
+                run_pgbackrest_backup,
+                CronTrigger.from_crontab(settings.backup_full_cron),
+                args=["full"],
+                id="pgbackrest_full",
+                name="PostgreSQL Full Backup (pgBackRest)",
+                replace_existing=True
+            )
+            
+            scheduler.add_job(
+                run_pgbackrest_backup,
+                CronTrigger.from_crontab(settings.backup_schedule_cron),
+                args=["incr"],
+                id="pgbackrest_incr",
+                name="PostgreSQL Incremental Backup (pgBackRest)",
+                replace_existing=True
+            )
+        elif settings.backup_method == "pg_basebackup":
+            # Full semanal + incremental diario encadenado por manifests
+            scheduler.add_job(
+                run_basebackup,
+                CronTrigger.from_crontab(settings.backup_full_cron),
+                args=[False],
+                id="basebackup_full",
+                name="PostgreSQL Full Base Backup",
+                replace_existing=True
+            )
+            
+            scheduler.add_job(
+                run_basebackup,
+                CronTrigger.from_crontab(settings.backup_schedule_cron),
+                args=[True],
+                id="basebackup_incr",
+                name="PostgreSQL Incremental Base Backup",
+                replace_existing=True
+            )
+        else:
+            # Backup diario a las 2 AM
+            scheduler.add_job(
+                run_postgres_backup,
+                CronTrigger.from_crontab(settings.backup_schedule_cron),
+                id="postgres_backup",
+                name="PostgreSQL Backup",
+                replace_existing=True
+            )
         
         scheduler.add_job(
-            backup_service.backup_qdrant,
+            run_qdrant_backup,
             CronTrigger.from_crontab(settings.backup_schedule_cron),
             id="qdrant_backup",
-            name="Qdrant Backup"
+            name="Qdrant Backup",
+            replace_existing=True
         )
     
     # Evaluación semanal los domingos a las 3 AM
     scheduler.add_job(
-        eval_service.run_evaluation,
+        run_weekly_evaluation,
         CronTrigger(day_of_week=0, hour=3, minute=0),
         id="weekly_evaluation",
-        name="Weekly RAG Evaluation"
+        name="Weekly RAG Evaluation",
+        replace_existing=True
     )
     
+    configured_jobs = {job.id for job in scheduler.get_jobs()}
+    
     # Iniciar scheduler
     scheduler.start()
+    
+    # Quitar jobs persistidos que ya no están en la configuración actual
+    # (p. ej. tras cambiar BACKUP_METHOD o desactivar backups)
+    for job in scheduler.get_jobs():
+        if job.id not in configured_jobs:
+            scheduler.remove_job(job.id)
+            logger.info(f"Removed stale job: {job.id}")
+    
     logger.info("Scheduler started successfully")
     
     try:
@@ -4,105 +4,79 @@ Script de verificación de dependencias
 Wiki Inteligente SAP IS-U
 """
 
+import re
 import sys
-import importlib
 import subprocess
+import tomllib
+from importlib import metadata
+from pathlib import Path
 from typing import List, Dict, Tuple
 
-# Lista de dependencias requeridas con sus versiones mínimas
-REQUIRED_PACKAGES = {
-    # Core framework
-    "fastapi": "0.104.0",
-    "uvicorn": "0.24.0",
-    "pydantic": "2.5.0",
-    "pydantic_settings": "2.1.0",
-    
-    # Database
-    "sqlalchemy": "2.0.0",
-    "asyncpg": "0.29.0",
-    "alembic": "1.13.0",
-    
-    # AI/ML
-    "openai": "1.3.0",
-    "tiktoken": "0.5.0",
-    "qdrant_client": "1.7.0",
-    
-    # Security
-    "python_jose": "3.3.0",
-    "passlib": "1.7.4",
-    "python_multipart": "0.0.6",
-    "bcrypt": "4.1.0",
-    
-    # Utilities
-    "requests": "2.31.0",
-    "aiofiles": "23.2.0",
-    "python_docx": "1.1.0",
-    "pypdf2": "3.0.0",
-    "beautifulsoup4": "4.12.0",
-    "markdown": "3.5.0",
-    
-    # Rate limiting
-    "slowapi": "0.1.9",
-    "redis": "5.0.0",
-    
-    # Scheduling
-    "apscheduler": "3.10.0",
-    
-    # Testing
-    "pytest": "7.4.0",
-    "pytest_asyncio": "0.21.0",
-    "pytest_cov": "4.1.0",
-    "httpx": "0.25.0",
-    
-    # Development
-    "black": "23.12.0",
-    "flake8": "6.1.0",
-    "isort": "5.13.0"
-}
+try:
+    from packaging.version import Version, InvalidVersion
+    PACKAGING_AVAILABLE = True
+except ImportError:
+    PACKAGING_AVAILABLE = False
+
+# Dependencias requeridas por categoría (se leen solo al ejecutar el checker)
+REQUIRED_PACKAGES_FILE = Path(__file__).with_name("required_packages.toml")
+
+
+def load_required_packages(path: Path = REQUIRED_PACKAGES_FILE) -> Dict[str, Dict[str, str]]:
+    """Cargar {categoría: {paquete: versión mínima}} desde el TOML"""
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
 
 class DependencyChecker:
     """Verificador de dependencias"""
     
-    def __init__(self):
+    def __init__(self, required_groups: Dict[str, Dict[str, str]]):
+        # Paquete -> versión mínima y paquete -> categoría, desde los grupos del TOML
+        self.required_packages = {}
+        self.package_category = {}
+        for category, packages in required_groups.items():
+            for package, min_version in packages.items():
+                self.required_packages[package] = min_version
+                self.package_category[package] = category
+        
         self.missing_packages = []
         self.outdated_packages = []
         self.installed_packages = []
+        
+        # Versiones instaladas leídas de los dist-info, sin importar ningún módulo
+        self.installed_versions = {}
+        for dist in metadata.distributions():
+            name = dist.metadata["Name"]
+            if name:
+                self.installed_versions.setdefault(self._normalize_name(name), dist.version)
     
     def check_package(self, package_name: str, min_version: str) -> Tuple[bool, str]:
         """Verificar si un paquete está instalado y actualizado"""
-        try:
-            # Mapear nombres de paquetes especiales
-            import_name = self._get_import_name(package_name)
-            
-            # Intentar importar
-            module = importlib.import_module(import_name)
-            
-            # Obtener versión si está disponible
-            version = getattr(module, '__version__', 'unknown')
-            
-            # Verificar versión mínima (simplificado)
-            if version != 'unknown' and self._compare_versions(version, min_version):
-                return True, version
-            else:
-                return True, f"{version} (min: {min_version})"
-                
-        except ImportError:
+        version = self.installed_versions.get(self._normalize_name(package_name))
+        
+        if version is None:
             return False, "Not installed"
+        
+        if self._compare_versions(version, min_version):
+            return True, version
+        else:
+            self.outdated_packages.append(package_name)
+            return True, f"{version} (min: {min_version})"
     
-    def _get_import_name(self, package_name: str) -> str:
-        """Mapear nombres de paquetes a nombres de import"""
-        mapping = {
-            "python_jose": "jose",
-            "python_multipart": "multipart",
-            "python_docx": "docx",
-            "pypdf2": "PyPDF2",
-            "beautifulsoup4": "bs4",
-            "pydantic_settings": "pydantic_settings"
-        }
-        return mapping.get(package_name, package_name)
+    def _normalize_name(self, package_name: str) -> str:
+        """Normalizar nombre de distribución (PEP 503) con guiones bajos"""
+        return re.sub(r"[-_.]+", "_", package_name).lower()
     
     def _compare_versions(self, current: str, minimum: str) -> bool:
-        """Comparar versiones (simplificado)"""
+        """Comparar versiones"""
+        if PACKAGING_AVAILABLE:
+            try:
+                return Version(current) >= Version(minimum)
+            except InvalidVersion:
+                return True  # Asumir que está bien si no podemos comparar
+        
+        # Comparación simplificada si packaging no está instalado
         try:
             current_parts = [int(x) for x in current.split('.')]
             minimum_parts = [int(x) for x in minimum.split('.')]
@@ -123,16 +97,11 @@ class DependencyChecker:
         
         results = {}
         
-        for package, min_version in REQUIRED_PACKAGES.items():
+        for package, min_version in self.required_packages.items():
             is_installed, version_info = self.check_package(package, min_version)
             
             status = "✅" if is_installed else "❌"
-            category = "Core" if package in ["fastapi", "uvicorn", "sqlalchemy"] else "Optional"
-            
-            if package in ["openai", "qdrant_client", "tiktoken"]:
-                category = "AI/ML"
-            elif package in ["pytest", "black", "flake8"]:
-                category = "Development"
+            category = self.package_category[package]
             
             results[package] = {
                 "installed": is_installed,
@@ -159,29 +128,15 @@ class DependencyChecker:
         # Comandos por categoría
         commands = []
         
-        # Core packages (críticos)
-        core_packages = [p for p in self.missing_packages 
-                        if p in ["fastapi", "uvicorn", "sqlalchemy", "pydantic", "asyncpg"]]
-        if core_packages:
-            commands.append(f"pip install {' '.join(core_packages)}")
-        
-        # AI/ML packages
-        ai_packages = [p for p in self.missing_packages 
-                      if p in ["openai", "tiktoken", "qdrant_client"]]
-        if ai_packages:
-            commands.append(f"pip install {' '.join(ai_packages)}")
+        # Core (críticos), AI/ML, Security y el resto como utilidades
+        groups = {"Core": [], "AI/ML": [], "Security": [], "Other": []}
+        for package in self.missing_packages:
+            category = self.package_category[package]
+            groups[category if category in groups else "Other"].append(package)
         
-        # Security packages
-        security_packages = [p for p in self.missing_packages 
-                           if p in ["python_jose", "passlib", "bcrypt"]]
-        if security_packages:
-            commands.append(f"pip install {' '.join(security_packages)}")
-        
-        # Utility packages
-        util_packages = [p for p in self.missing_packages 
-                        if p not in core_packages + ai_packages + security_packages]
-        if util_packages:
-            commands.append(f"pip install {' '.join(util_packages)}")
+        for packages in groups.values():
+            if packages:
+                commands.append(f"pip install {' '.join(packages)}")
         
         return commands
     
@@ -191,24 +146,11 @@ class DependencyChecker:
             f.write("# Requirements verificados para Wiki Inteligente SAP IS-U\n")
             f.write("# Generado automáticamente\n\n")
             
-            categories = {
-                "Core": [],
-                "AI/ML": [],
-                "Security": [],
-                "Development": [],
-                "Optional": []
-            }
-            
-            for package, min_version in REQUIRED_PACKAGES.items():
-                category = "Core" if package in ["fastapi", "uvicorn", "sqlalchemy"] else "Optional"
-                if package in ["openai", "qdrant_client", "tiktoken"]:
-                    category = "AI/ML"
-                elif package in ["python_jose", "passlib", "bcrypt"]:
-                    category = "Security"
-                elif package in ["pytest", "black", "flake8"]:
-                    category = "Development"
-                
-                categories[category].append(f"{package}>={min_version}")
+            # Mismas categorías y orden que los grupos del TOML
+            categories = {}
+            for package, min_version in self.required_packages.items():
+                category = self.package_category[package]
+                categories.setdefault(category, []).append(f"{package}>={min_version}")
             
             for category, packages in categories.items():
                 if packages:
@@ -224,13 +166,13 @@ def main():
     print("🔍 Wiki Inteligente SAP IS-U - Verificador de Dependencias")
     print("=" * 60)
     
-    checker = DependencyChecker()
+    checker = DependencyChecker(load_required_packages())
     results = checker.check_all_dependencies()
     
     print(f"\n📊 Resumen:")
     print(f"   ✅ Instalados: {len(checker.installed_packages)}")
     print(f"   ❌ Faltantes:  {len(checker.missing_packages)}")
-    print(f"   📦 Total:      {len(REQUIRED_PACKAGES)}")
+    print(f"   📦 Total:      {len(checker.required_packages)}")
     
     if checker.missing_packages:
         print(f"\n🔧 Paquetes faltantes:")
@@ -5,133 +5,262 @@ Wiki Inteligente SAP IS-U
 """
 
 import asyncio
+import contextlib
+import functools
 import json
+import logging
 import os
-from typing import List, Dict
+import random
+import re
+from typing import List, Dict, Tuple
 from pathlib import Path
 
-# Nota: requests se instala con: pip install requests
+# Nota: aiohttp se instala con: pip install aiohttp
 try:
-    import requests
+    import aiohttp
 except ImportError:
-    print("⚠️  Warning: 'requests' no instalado. Ejecutar: pip install requests")
-    requests = None
+    print("⚠️  Warning: 'aiohttp' no instalado. Ejecutar: pip install aiohttp")
+    aiohttp = None
+
+# ijson es opcional: permite procesar JSON grandes en streaming
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# Resultados por documento: logging con formato diferido (SAP_FEEDER_LOG_LEVEL=WARNING
+# deja solo los errores sin construir los mensajes de éxito)
+logger = logging.getLogger("feed_knowledge")
 
 # Configuración del sistema
 API_BASE = "http://localhost:8000/api/v1"
+HEALTH_URL = API_BASE.rsplit("/api/", 1)[0] + "/health"  # /health cuelga de la raíz
 TENANT = "STANDARD"  # O tu tenant específico
 AUTH_EMAIL = "admin@sapisu.local"
 AUTH_PASSWORD = "admin123"
+# Endpoints y campos de formulario comunes, calculados una sola vez
+INGEST_TEXT_URL = f"{API_BASE}/ingest/text"
+INGEST_FILES_URL = f"{API_BASE}/ingest/files"
+UPLOAD_FORM_FIELDS = (('tenant_slug', TENANT), ('scope', 'STANDARD'))
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Peticiones de ingesta en paralelo (configurable por entorno)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("SAP_UPLOAD_WORKERS", "16"))
+JSON_STREAMING_THRESHOLD = 1024 * 1024  # A partir de 1MB los arrays JSON se leen en streaming
+UPLOAD_BUFFER_SIZE = 1 << 18  # Buffer de lectura de 256KB para subir binarios grandes
+FILES_PER_REQUEST = 10  # Máximo de archivos que acepta /ingest/files por petición
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # Tamaño máximo por archivo que acepta /ingest/files
+# Reintentos ante fallos transitorios (408 no se reintenta: reenviaría cuerpos grandes)
+MAX_RETRIES = 3
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Tipo de procesamiento por extensión de archivo
+FILE_KINDS = {
+    '.txt': 'text',
+    '.md': 'text',
+    '.json': 'json',
+    '.pdf': 'binary',
+    '.docx': 'binary'
+}
+
+# Reglas de clasificación por nombre de archivo: (grupo, patrón, topic, type).
+# El orden de la lista es la prioridad cuando coinciden varias categorías, y
+# añadir un tema nuevo es añadir una fila, sin tocar el código de inferencia
+_FILENAME_RULES = [
+    ('table', rb'tabla|table', "master-data", "table_documentation"),
+    ('process', rb'proceso|process', "business-process", "process_documentation"),
+    ('incident', rb'incidencia|error|problem', "troubleshooting", "incident_solution"),
+    ('config', rb'config|customizing', "configuration", "configuration_guide"),
+]
+# Se trabaja sobre bytes: las palabras clave son ASCII y así se evita str.lower()
+_KW_RE = re.compile(
+    b"|".join(b"(?P<%s>%s)" % (name.encode(), pattern) for name, pattern, _, _ in _FILENAME_RULES),
+    re.IGNORECASE
+)
+_KW_MAP = {
+    name: (priority, topic, doc_type)
+    for priority, (name, _, topic, doc_type) in enumerate(_FILENAME_RULES)
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _infer_metadata_from_filename(filename: str) -> Tuple[Tuple[str, str], ...]:
+    """Inferir metadatos del nombre del archivo.
+    
+    Devuelve pares inmutables para que la caché sea segura; el llamador crea el dict.
+    """
+    metadata = {"system": "IS-U", "type": "general"}
+    
+    # Inferir tema con una sola pasada de la expresión compilada, recorriendo
+    # las coincidencias de forma perezosa sin materializar listas intermedias
+    name_bytes = filename.encode('utf-8', 'surrogateescape')
+    best = min((_KW_MAP[match.lastgroup] for match in _KW_RE.finditer(name_bytes)), default=None)
+    if best:
+        _, metadata["topic"], metadata["type"] = best
+    
+    return tuple(metadata.items())
+
 
 class KnowledgeFeeder:
     """Alimentador de conocimiento masivo"""
     
     def __init__(self):
-        self.session = requests.Session()
+        self.session = None
         self.token = None
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self._warmup = None
+    
+    async def __aenter__(self):
+        # Pool de conexiones keep-alive dimensionado al límite de concurrencia
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=MAX_CONCURRENT_REQUESTS,
+                limit_per_host=MAX_CONCURRENT_REQUESTS,
+                keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=120, connect=10)
+        )
+        # DNS + conexión en segundo plano para que la primera ingesta no pague el arranque
+        self._warmup = asyncio.create_task(self._warm_connection())
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self._warmup.done():
+            self._warmup.cancel()
+        await self.session.close()
+    
+    async def _warm_connection(self):
+        """Abrir una conexión keep-alive contra /health; los fallos se ignoran"""
+        try:
+            async with self.session.get(HEALTH_URL, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
     
-    def authenticate(self):
+    async def authenticate(self):
         """Autenticarse en el sistema"""
-        response = self.session.post(f"{API_BASE}/auth/login", json={
+        async with self.session.post(f"{API_BASE}/auth/login", json={
             "email": AUTH_EMAIL,
             "password": AUTH_PASSWORD
-        })
+        }) as response:
+            if response.status == 200:
+                self.token = (await response.json())["access_token"]
+                self.session.headers.update({
+                    "Authorization": f"Bearer {self.token}"
+                })
+                print("✅ Autenticación exitosa")
+            else:
+                raise Exception("❌ Error de autenticación")
+    
+    async def _post_with_retry(self, url: str, build_request):
+        """POST con backoff exponencial y jitter ante errores de red, 5xx y 429.
         
-        if response.status_code == 200:
-            self.token = response.json()["access_token"]
-            self.session.headers.update({
-                "Authorization": f"Bearer {self.token}"
-            })
-            print("✅ Autenticación exitosa")
-        else:
-            raise Exception("❌ Error de autenticación")
+        build_request se invoca en cada intento y devuelve los kwargs de la petición,
+        de modo que los cuerpos en streaming se reconstruyen desde el principio.
+        """
+        for attempt in range(MAX_RETRIES):
+            last_attempt = attempt == MAX_RETRIES - 1
+            delay = 2 ** attempt + random.random() * 0.25
+            
+            try:
+                response = await self.session.post(url, **build_request())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            else:
+                if response.status not in RETRYABLE_STATUS or last_attempt:
+                    return response
+                
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+                response.release()
+            
+            await asyncio.sleep(delay)
+    
+    async def _post_text(self, payload: Dict, label: str, success_message: str):
+        """Enviar un documento a /ingest/text respetando el límite de concurrencia"""
+        try:
+            # Cuerpo y cabeceras se preparan una vez y se reutilizan en cada reintento
+            body = json.dumps(payload).encode('utf-8')
+            async with self._semaphore:
+                response = await self._post_with_retry(
+                    INGEST_TEXT_URL, lambda: {"data": body, "headers": JSON_HEADERS}
+                )
+                async with response:
+                    if response.status == 200:
+                        logger.info("  ✅ %s: %s", label, success_message)
+                    else:
+                        logger.error("  ❌ %s: Error - %s", label, await response.text())
+                        
+        except Exception as e:
+            logger.error("  ❌ %s: Excepción - %s", label, e)
     
-    def feed_table_documentation(self, table_docs: List[Dict]):
+    async def feed_table_documentation(self, table_docs: List[Dict]):
         """Alimentar documentación de tablas"""
         print(f"\n📊 Alimentando documentación de {len(table_docs)} tablas...")
         
-        for doc in table_docs:
-            try:
-                response = self.session.post(f"{API_BASE}/ingest/text", json={
-                    "tenant_slug": TENANT,
-                    "scope": "STANDARD",
-                    "text": doc["content"],
-                    "source": f"table_doc_{doc['table']}",
-                    "metadata": {
-                        "system": "IS-U",
-                        "topic": "master-data",
-                        "tables": [doc["table"]],
-                        "tcodes": doc.get("tcodes", []),
-                        "type": "table_documentation"
-                    }
-                })
-                
-                if response.status_code == 200:
-                    print(f"  ✅ {doc['table']}: Documentación procesada")
-                else:
-                    print(f"  ❌ {doc['table']}: Error - {response.text}")
-                    
-            except Exception as e:
-                print(f"  ❌ {doc['table']}: Excepción - {e}")
+        await asyncio.gather(*[
+            self._post_text({
+                "tenant_slug": TENANT,
+                "scope": "STANDARD",
+                "text": doc["content"],
+                "source": f"table_doc_{doc['table']}",
+                "metadata": {
+                    "system": "IS-U",
+                    "topic": "master-data",
+                    "tables": [doc["table"]],
+                    "tcodes": doc.get("tcodes", []),
+                    "type": "table_documentation"
+                }
+            }, doc["table"], "Documentación procesada")
+            for doc in table_docs
+        ])
     
-    def feed_process_documentation(self, process_docs: List[Dict]):
+    async def feed_process_documentation(self, process_docs: List[Dict]):
         """Alimentar documentación de procesos"""
         print(f"\n🔄 Alimentando {len(process_docs)} procesos de negocio...")
         
-        for doc in process_docs:
-            try:
-                response = self.session.post(f"{API_BASE}/ingest/text", json={
-                    "tenant_slug": TENANT,
-                    "scope": "STANDARD", 
-                    "text": doc["content"],
-                    "source": f"process_{doc['name']}",
-                    "metadata": {
-                        "system": "IS-U",
-                        "topic": doc.get("topic", "business-process"),
-                        "tcodes": doc.get("tcodes", []),
-                        "tables": doc.get("tables", []),
-                        "type": "process_documentation"
-                    }
-                })
-                
-                if response.status_code == 200:
-                    print(f"  ✅ {doc['name']}: Proceso documentado")
-                else:
-                    print(f"  ❌ {doc['name']}: Error - {response.text}")
-                    
-            except Exception as e:
-                print(f"  ❌ {doc['name']}: Excepción - {e}")
+        await asyncio.gather(*[
+            self._post_text({
+                "tenant_slug": TENANT,
+                "scope": "STANDARD", 
+                "text": doc["content"],
+                "source": f"process_{doc['name']}",
+                "metadata": {
+                    "system": "IS-U",
+                    "topic": doc.get("topic", "business-process"),
+                    "tcodes": doc.get("tcodes", []),
+                    "tables": doc.get("tables", []),
+                    "type": "process_documentation"
+                }
+            }, doc["name"], "Proceso documentado")
+            for doc in process_docs
+        ])
     
-    def feed_incident_solutions(self, incidents: List[Dict]):
+    async def feed_incident_solutions(self, incidents: List[Dict]):
         """Alimentar soluciones de incidencias"""
         print(f"\n🔧 Alimentando {len(incidents)} soluciones de incidencias...")
         
-        for incident in incidents:
-            try:
-                response = self.session.post(f"{API_BASE}/ingest/text", json={
-                    "tenant_slug": TENANT,
-                    "scope": "STANDARD",
-                    "text": incident["content"],
-                    "source": f"incident_{incident['id']}",
-                    "metadata": {
-                        "system": "IS-U",
-                        "topic": incident.get("topic", "troubleshooting"),
-                        "tcodes": incident.get("tcodes", []),
-                        "tables": incident.get("tables", []),
-                        "type": "incident_solution",
-                        "severity": incident.get("severity", "medium")
-                    }
-                })
-                
-                if response.status_code == 200:
-                    print(f"  ✅ Incidencia {incident['id']}: Solución agregada")
-                else:
-                    print(f"  ❌ Incidencia {incident['id']}: Error - {response.text}")
-                    
-            except Exception as e:
-                print(f"  ❌ Incidencia {incident['id']}: Excepción - {e}")
+        await asyncio.gather(*[
+            self._post_text({
+                "tenant_slug": TENANT,
+                "scope": "STANDARD",
+                "text": incident["content"],
+                "source": f"incident_{incident['id']}",
+                "metadata": {
+                    "system": "IS-U",
+                    "topic": incident.get("topic", "troubleshooting"),
+                    "tcodes": incident.get("tcodes", []),
+                    "tables": incident.get("tables", []),
+                    "type": "incident_solution",
+                    "severity": incident.get("severity", "medium")
+                }
+            }, f"Incidencia {incident['id']}", "Solución agregada")
+            for incident in incidents
+        ])
     
-    def feed_from_files(self, directory: str):
+    async def feed_from_files(self, directory: str):
         """Alimentar desde archivos en directorio"""
         print(f"\n📁 Procesando archivos en {directory}...")
         
@@ -141,397 +270,221 @@ class KnowledgeFeeder:
             return
         
         # Procesar diferentes tipos de archivo
-        for file_path in path.rglob("*"):
-            if file_path.is_file():
-                extension = file_path.suffix.lower()
-                
-                if extension in ['.txt', '.md']:
-                    self._process_text_file(file_path)
-                elif extension in ['.json']:
-                    self._process_json_file(file_path)
-                elif extension in ['.pdf', '.docx']:
-                    self._process_binary_file(file_path)
+        processors = {
+            'text': self._process_text_file,
+            'json': self._process_json_file
+        }
+        binary_files = []
+        
+        def file_jobs():
+            # Generador: cada archivo se lee solo cuando entra en la ventana de concurrencia
+            add_binary, max_size = binary_files.append, MAX_UPLOAD_SIZE
+            for file_path, kind in self._walk_supported_files(directory):
+                if kind == 'binary':
+                    # El servidor rechaza los binarios de más de 10MB: no se envía el cuerpo
+                    if file_path.stat().st_size > max_size:
+                        logger.error("  ❌ %s: Archivo demasiado grande (máx. 10MB)", file_path.name)
+                        continue
+                    add_binary(file_path)
+                else:
+                    yield processors[kind](file_path)
+            
+            # Los binarios se agrupan en una sola petición multipart por lote
+            for i in range(0, len(binary_files), FILES_PER_REQUEST):
+                yield self._upload_files_async(binary_files[i:i + FILES_PER_REQUEST])
+        
+        await self._run_windowed(file_jobs())
     
-    def _process_text_file(self, file_path: Path):
+    def _walk_supported_files(self, directory: str):
+        """Recorrer el árbol con os.scandir filtrando por extensión antes de crear Paths"""
+        pending = [directory]
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        kind = FILE_KINDS.get(os.path.splitext(entry.name)[1].lower())
+                        if kind:
+                            yield Path(entry.path), kind
+    
+    async def _process_text_file(self, file_path: Path):
         """Procesar archivo de texto"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
-            
-            # Inferir metadatos del nombre del archivo
-            metadata = self._infer_metadata_from_filename(file_path.name)
-            
-            response = self.session.post(f"{API_BASE}/ingest/text", json={
-                "tenant_slug": TENANT,
-                "scope": "STANDARD",
-                "text": content,
-                "source": f"file_{file_path.name}",
-                "metadata": metadata
-            })
-            
-            if response.status_code == 200:
-                print(f"  ✅ {file_path.name}: Archivo procesado")
-            else:
-                print(f"  ❌ {file_path.name}: Error - {response.text}")
-                
         except Exception as e:
-            print(f"  ❌ {file_path.name}: Excepción - {e}")
+            logger.error("  ❌ %s: Excepción - %s", file_path.name, e)
+            return
+        
+        # Inferir metadatos del nombre del archivo
+        metadata = dict(_infer_metadata_from_filename(file_path.name))
+        
+        await self._post_text({
+            "tenant_slug": TENANT,
+            "scope": "STANDARD",
+            "text": content,
+            "source": f"file_{file_path.name}",
+            "metadata": metadata
+        }, file_path.name, "Archivo procesado")
     
-    def _process_json_file(self, file_path: Path):
+    async def _process_json_file(self, file_path: Path):
         """Procesar archivo JSON estructurado"""
         try:
+            if IJSON_AVAILABLE and file_path.stat().st_size >= JSON_STREAMING_THRESHOLD:
+                with open(file_path, 'rb') as f:
+                    first_char = f.read(64).lstrip()[:1]
+                    f.seek(0)
+                    if first_char == b'[':
+                        await self._stream_json_items(f, file_path.name)
+                        return
+            
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
             # Si es un array de documentos
             if isinstance(data, list):
-                for item in data:
-                    if "content" in item:
-                        self._ingest_json_item(item, file_path.name)
+                await asyncio.gather(*[
+                    self._ingest_json_item(item, file_path.name)
+                    for item in data if "content" in item
+                ])
             # Si es un documento único
             elif "content" in data:
-                self._ingest_json_item(data, file_path.name)
+                await self._ingest_json_item(data, file_path.name)
                 
         except Exception as e:
-            print(f"  ❌ {file_path.name}: Excepción JSON - {e}")
+            logger.error("  ❌ %s: Excepción JSON - %s", file_path.name, e)
+    
+    async def _stream_json_items(self, f, filename: str):
+        """Ingestar un array JSON grande item a item, sin cargarlo entero en memoria"""
+        # use_float: sin él los decimales llegan como Decimal y json.dumps falla
+        await self._run_windowed(
+            self._ingest_json_item(item, filename)
+            for item in ijson.items(f, 'item', use_float=True)
+            if "content" in item
+        )
+    
+    async def _run_windowed(self, jobs):
+        """Ejecutar corrutinas de un iterable perezoso con como mucho MAX_CONCURRENT_REQUESTS en vuelo"""
+        pending = set()
+        for job in jobs:
+            pending.add(asyncio.create_task(job))
+            
+            # Limitar el trabajo en vuelo para que la memoria no crezca con la entrada
+            if len(pending) >= MAX_CONCURRENT_REQUESTS:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        
+        if pending:
+            await asyncio.wait(pending)
     
-    def _ingest_json_item(self, item: Dict, filename: str):
+    async def _ingest_json_item(self, item: Dict, filename: str):
         """Ingestar item individual desde JSON"""
-        response = self.session.post(f"{API_BASE}/ingest/text", json={
+        await self._post_text({
             "tenant_slug": TENANT,
             "scope": item.get("scope", "STANDARD"),
             "text": item["content"],
             "source": f"json_{filename}_{item.get('id', 'unknown')}",
             "metadata": item.get("metadata", {})
-        })
-        
-        if response.status_code == 200:
-            print(f"    ✅ Item {item.get('id', 'sin_id')}: Procesado")
-        else:
-            print(f"    ❌ Item {item.get('id', 'sin_id')}: Error")
+        }, f"Item {item.get('id', 'sin_id')}", "Procesado")
     
-    def _process_binary_file(self, file_path: Path):
-        """Procesar archivos binarios (PDF, DOCX)"""
+    @staticmethod
+    def _open_for_upload(file_path: Path):
+        """Abrir un binario para un intento de subida, con lectura secuencial"""
+        # Descriptor síncrono a propósito: aiohttp lo lee en bloques grandes desde el
+        # event loop, más rápido en SSD que aiofiles (un salto al thread pool por read).
+        # Si en NFS/disco lento dominara la apertura, envolver solo esta llamada en
+        # asyncio.to_thread.
+        fd = os.open(file_path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': (file_path.name, f, 'application/octet-stream')}
-                data = {
-                    'tenant_slug': TENANT,
-                    'scope': 'STANDARD'
-                }
-                
-                response = self.session.post(f"{API_BASE}/ingest/file", 
-                                           files=files, data=data)
-            
-            if response.status_code == 200:
-                print(f"  ✅ {file_path.name}: Archivo binario procesado")
-            else:
-                print(f"  ❌ {file_path.name}: Error - {response.text}")
+            # En Linux se pide al kernel readahead agresivo para solapar disco y red
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            return os.fdopen(fd, 'rb', buffering=UPLOAD_BUFFER_SIZE)
+        except OSError:
+            os.close(fd)
+            raise
+    
+    async def _upload_files_async(self, file_paths: List[Path]):
+        """Subir un lote de archivos binarios (PDF, DOCX) en una petición a /ingest/files"""
+        label = ", ".join(file_path.name for file_path in file_paths)
+        try:
+            async with self._semaphore:
+                with contextlib.ExitStack() as stack:
+                    # FormData envía los archivos abiertos en streaming por bloques,
+                    # sin cargarlos enteros en memoria; el ExitStack cierra los que
+                    # aiohttp no haya cerrado ya (p.ej. si el envío falla antes)
+                    
+                    def build_form():
+                        # aiohttp cierra cada archivo tras enviarlo: se reabren por intento
+                        data = aiohttp.FormData()
+                        add_field = data.add_field
+                        for file_path in file_paths:
+                            f = stack.enter_context(self._open_for_upload(file_path))
+                            add_field('files', f, filename=file_path.name,
+                                      content_type='application/octet-stream')
+                        for name, value in UPLOAD_FORM_FIELDS:
+                            add_field(name, value)
+                        return {"data": data}
+                    
+                    response = await self._post_with_retry(INGEST_FILES_URL, build_form)
+                    async with response:
+                        if response.status != 200:
+                            logger.error("  ❌ %s: Error - %s", label, await response.text())
+                            return
+                        
+                        # El endpoint responde 200 con el resultado de cada archivo
+                        for result in await response.json():
+                            if result.get("success"):
+                                logger.info("  ✅ %s: Archivo binario procesado", result['filename'])
+                            else:
+                                logger.error("  ❌ %s: Error - %s", result['filename'], result.get('error'))
                 
         except Exception as e:
-            print(f"  ❌ {file_path.name}: Excepción - {e}")
-    
-    def _infer_metadata_from_filename(self, filename: str) -> Dict:
-        """Inferir metadatos del nombre del archivo"""
-        metadata = {"system": "IS-U", "type": "general"}
-        
-        filename_lower = filename.lower()
-        
-        # Inferir tema
-        if any(word in filename_lower for word in ['tabla', 'table']):
-            metadata["topic"] = "master-data"
-            metadata["type"] = "table_documentation"
-        elif any(word in filename_lower for word in ['proceso', 'process']):
-            metadata["topic"] = "business-process"
-            metadata["type"] = "process_documentation"
-        elif any(word in filename_lower for word in ['incidencia', 'error', 'problem']):
-            metadata["topic"] = "troubleshooting"
-            metadata["type"] = "incident_solution"
-        elif any(word in filename_lower for word in ['config', 'customizing']):
-            metadata["topic"] = "configuration"
-            metadata["type"] = "configuration_guide"
-        
-        return metadata
-
+            logger.error("  ❌ %s: Excepción - %s", label, e)
 
 # ====================================================================
 # DATOS DE EJEMPLO PARA ALIMENTAR
 # ====================================================================
 
-# Documentación de tablas principales
-TABLE_DOCS = [
-    {
-        "table": "BUT000",
-        "content": """
-Tabla BUT000 - Business Partner Master Data
-===========================================
-
-Descripción: Tabla principal para almacenar datos básicos de Business Partners en SAP IS-U.
-
-Campos clave:
-- PARTNER: Número único de Business Partner (10 caracteres)
-- TYPE: Tipo de BP (1=Persona física, 2=Organización, 3=Grupo)
-- TITLE: Tratamiento (Sr., Sra., Dr., etc.)
-- NAME1: Apellido o nombre de empresa
-- NAME2: Nombre o denominación adicional
-- BIRTHDT: Fecha de nacimiento (solo personas físicas)
-- CREAT_DATE: Fecha de creación del registro
-- CREAT_TIME: Hora de creación
-
-Indices principales:
-- Primario: PARTNER
-- Secundario: SEARCHTERM1 (término de búsqueda)
-
-Relaciones:
-- BUT020: Direcciones del Business Partner
-- BUT050: Datos de comunicación (teléfono, email, fax)
-- EVER: Contratos de suministro asociados
-- FKKVKP: Datos de partner contractual para facturación
-
-Validaciones importantes:
-- PARTNER debe ser único en el sistema
-- NAME1 es campo obligatorio
-- TYPE debe corresponder a valores válidos en customizing
-- SEARCHTERM1 se genera automáticamente si no se proporciona
-
-Customizing relacionado:
-- SPRO → IS-U → Business Partner → Basic Settings
-- Definición de tipos de BP
-- Configuración de campos obligatorios por tipo
-
-Errores comunes:
-- "Business Partner does not exist": PARTNER no existe en BUT000
-- "Incomplete data": Campos obligatorios no completados
-- "Duplicate search term": SEARCHTERM1 ya existe para otro BP
-
-Programas útiles:
-- SAPDBUT0: Creación masiva de Business Partners
-- RFBU0001: Lista de Business Partners
-- BUP2: Mantenimiento individual de BP (transacción)
-        """,
-        "tcodes": ["BP", "BUP2", "ES21", "ES31"]
-    },
-    {
-        "table": "EVER",
-        "content": """
-Tabla EVER - Installation Master Data
-=====================================
-
-Descripción: Tabla central para instalaciones y contratos en SAP IS-U.
-
-Campos principales:
-- ANLAGE: Número de instalación (clave primaria)
-- PARTNER: Business Partner asociado (referencia a BUT000)
-- VERTRAG: Número de contrato
-- VERTRAGSART: Tipo de contrato
-- EINZDAT: Fecha de move-in (alta)
-- AUSZDAT: Fecha de move-out (baja)
-- STATUS: Estado del contrato (A=Activo, I=Inactivo, etc.)
-- SPARTE: División (electricidad, gas, agua)
-- TARIFF: Tarifa aplicable
-- AKTIVDAT: Fecha de activación
-
-Estados de contrato:
-- A: Activo
-- I: Inactivo
-- T: Terminado
-- S: Suspendido
-
-Campos de fecha críticos:
-- EINZDAT: Inicio del suministro
-- AUSZDAT: Fin del suministro
-- AKTIVDAT: Activación del contrato
-- BEENDDAT: Fecha de finalización
-
-Relaciones importantes:
-- BUT000: Datos del Business Partner (via PARTNER)
-- EUITRANS: Punto de suministro técnico
-- EABL: Documentos de facturación
-- EANLH: Historial de aparatos instalados
+# Los documentos de ejemplo viven en un JSON compartido con populate_data.py y
+# solo se cargan al ejecutar el alimentador, no al importar el módulo
+SAMPLE_DOCS_PATH = Path(__file__).with_name("sample_docs.json")
 
-Validaciones críticas:
-- PARTNER debe existir en BUT000
-- Fechas no pueden solaparse para mismo punto de suministro
-- STATUS debe ser válido según customizing
-- SPARTE debe estar configurada en sistema
 
-T-codes relacionadas:
-- ES21: Crear instalación
-- ES22: Modificar instalación  
-- ES23: Visualizar instalación
-- ES31: Account determination
-- ES32: Activar contrato
+@functools.lru_cache(maxsize=1)
+def load_sample_docs() -> Dict[str, List[Dict]]:
+    """Cargar los documentos de ejemplo (tablas, procesos, incidencias)"""
+    return json.loads(SAMPLE_DOCS_PATH.read_bytes())
 
-Índices:
-- Primario: ANLAGE
-- Secundarios: PARTNER, VERTRAG, VKONTO
 
-Programas de análisis:
-- ES03: Lista de instalaciones
-- ES13: Análisis de contratos
-- RFIS-U01: Extracto de instalaciones
-        """,
-        "tcodes": ["ES21", "ES22", "ES23", "ES31", "ES32"]
-    }
-]
-
-# Procesos de negocio
-PROCESS_DOCS = [
-    {
-        "name": "move_in_process",
-        "topic": "move-in",
-        "content": """
-Proceso Move-in: Alta de Suministro en SAP IS-U
-===============================================
-
-Objetivo: Dar de alta un nuevo suministro para un cliente.
-
-FASE 1: Preparación y Validación
---------------------------------
-1. Verificar datos del Business Partner:
-   - Transacción: BP
-   - Validar completitud en BUT000
-   - Confirmar roles asignados en BUT020
-   - Verificar datos de comunicación en BUT050
-
-2. Validar disponibilidad del punto de suministro:
-   - Consultar EUITRANS para estado
-   - Verificar que no haya contratos activos solapados
-   - Confirmar datos técnicos de la instalación
-
-FASE 2: Creación de la Instalación
-----------------------------------
-1. Ejecutar transacción ES21:
-   - Ingresar Business Partner
-   - Seleccionar point of delivery
-   - Configurar fechas de inicio
-   - Asignar tipo de contrato
-
-2. Sistema actualiza:
-   - EVER: Crea registro de instalación
-   - EVERG: Relaciona BP con instalación
-   - EUITRANS: Actualiza estado del punto
-
-FASE 3: Configuración de Aparatos
----------------------------------
-1. Asignar aparatos de medición:
-   - Transacción: EL31
-   - Configurar en EANLH
-   - Establecer lecturas iniciales
-
-2. Registrar lectura inicial:
-   - Transacción: EL21
-   - Actualizar EABLG
-   - Validar datos técnicos
-
-FASE 4: Activación del Contrato
--------------------------------
-1. Activar con ES32:
-   - Sistema valida todas las dependencias
-   - Actualiza EVER.STATUS = 'A'
-   - Establece EVER.AKTIVDAT
-
-Validaciones críticas:
-- BP debe tener rol 'Applicant'
-- Fechas no pueden solaparse
-- Aparatos deben estar correctamente configurados
-- Lectura inicial es obligatoria
-
-Errores frecuentes y soluciones:
-- "BP not authorized": Asignar rol correcto en BUT020
-- "Installation exists": Verificar fechas en EVER
-- "Device conflict": Revisar EANLH para solapamientos
-- "Missing reading": Completar EABLG con EL21
-
-Post-proceso:
-- Verificar creación correcta con ES23
-- Configurar facturación automática si aplica
-- Documentar casos especiales
-        """,
-        "tcodes": ["BP", "ES21", "ES23", "ES32", "EL31", "EL21"],
-        "tables": ["BUT000", "BUT020", "EVER", "EANLH", "EABLG", "EUITRANS"]
-    }
-]
-
-# Soluciones de incidencias
-INCIDENT_SOLUTIONS = [
-    {
-        "id": "001_bp_not_valid",
-        "topic": "troubleshooting",
-        "severity": "high",
-        "content": """
-Incidencia: Business Partner no válido en ES21
-==============================================
-
-Síntoma: Al intentar crear instalación con ES21, sistema muestra error "Business Partner not valid" o "BP not authorized".
-
-Causas posibles:
-1. BP no existe en tabla BUT000
-2. BP no tiene el rol correcto asignado
-3. BP está inactivo o bloqueado
-4. Faltan datos obligatorios en BUT000
-
-Diagnóstico paso a paso:
-1. Verificar existencia del BP:
-   - Transacción: BP
-   - Buscar por número o nombre
-   - Confirmar que existe en BUT000
-
-2. Verificar roles asignados:
-   - En BP, ir a pestaña "Roles"
-   - Verificar que tiene rol "Applicant" (FLROLE 'APL')
-   - Fechas de validez del rol deben incluir fecha actual
-
-3. Verificar estado del BP:
-   - Campo BUT000.PARTNERSTAT debe ser activo
-   - No debe tener indicadores de bloqueo
-
-4. Verificar datos obligatorios:
-   - BUT000.NAME1 debe estar completo
-   - Según configuración, pueden requerirse otros campos
-
-Solución:
-1. Si BP no existe: Crear con transacción BP
-2. Si falta rol: Asignar rol "Applicant" con fechas válidas
-3. Si está bloqueado: Desbloquear o crear BP nuevo
-4. Si faltan datos: Completar campos obligatorios
-
-Prevención:
-- Validar BP antes de procesos de move-in
-- Mantener roles actualizados
-- Documentar requirements por tipo de BP
-
-Tablas afectadas: BUT000, BUT020
-Transacciones: BP, ES21
-Severidad: Alta (bloquea proceso de alta)
-        """,
-        "tcodes": ["BP", "ES21"],
-        "tables": ["BUT000", "BUT020"]
-    }
-]
-
-
-def main():
+async def main():
     """Función principal para alimentar conocimiento"""
+    logging.basicConfig(
+        level=os.getenv("SAP_FEEDER_LOG_LEVEL", "INFO").upper(),
+        format="%(message)s"
+    )
     print("🔍 Wiki Inteligente SAP IS-U - Alimentador de Conocimiento")
     print("=" * 60)
     
-    # Inicializar feeder
-    feeder = KnowledgeFeeder()
-    
     try:
-        # Autenticarse
-        feeder.authenticate()
-        
-        # Alimentar diferentes tipos de conocimiento
-        feeder.feed_table_documentation(TABLE_DOCS)
-        feeder.feed_process_documentation(PROCESS_DOCS)
-        feeder.feed_incident_solutions(INCIDENT_SOLUTIONS)
-        
-        # Opcionalmente, procesar archivos de un directorio
-        knowledge_dir = input("\n📁 ¿Directorio con archivos adicionales? (Enter para saltar): ")
-        if knowledge_dir and os.path.exists(knowledge_dir):
-            feeder.feed_from_files(knowledge_dir)
+        # Inicializar feeder
+        async with KnowledgeFeeder() as feeder:
+            # Autenticarse
+            await feeder.authenticate()
+            
+            # Alimentar diferentes tipos de conocimiento; son independientes, así que
+            # se lanzan a la vez y comparten la sesión y el límite de concurrencia
+            sample_docs = load_sample_docs()
+            await asyncio.gather(
+                feeder.feed_table_documentation(sample_docs["TABLE_DOCS"]),
+                feeder.feed_process_documentation(sample_docs["PROCESS_DOCS"]),
+                feeder.feed_incident_solutions(sample_docs["INCIDENT_SOLUTIONS"])
+            )
+            
+            # Opcionalmente, procesar archivos de un directorio
+            knowledge_dir = input("\n📁 ¿Directorio con archivos adicionales? (Enter para saltar): ")
+            if knowledge_dir and os.path.exists(knowledge_dir):
+                await feeder.feed_from_files(knowledge_dir)
         
         print("\n🎉 ¡Alimentación de conocimiento completada!")
         print("\nPuedes ahora hacer consultas como:")
@@ -545,4 +498,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
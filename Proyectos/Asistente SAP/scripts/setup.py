@@ -3,8 +3,10 @@
 Script de setup inicial para Wiki Inteligente SAP IS-U
 """
 import asyncio
+import importlib.util
 import os
 import sys
+from dataclasses import astuple, dataclass
 from pathlib import Path
 
 # Añadir el directorio del proyecto al path
@@ -21,44 +23,61 @@ from api.utils.logging import configure_logging, get_logger
 configure_logging()
 logger = get_logger(__name__)
 
+# Valor de ejemplo de .env.example que no debe usarse como secreto real
+DEFAULT_JWT_SECRET = "your_very_long_and_secure_secret_key_here_change_in_production"
+
+# Módulos imprescindibles -> paquete pip que los provee
+REQUIRED_MODULES = (
+    ("fastapi", "fastapi"),
+    ("sqlalchemy", "sqlalchemy"),
+    ("qdrant_client", "qdrant-client"),
+    ("openai", "openai"),
+)
+
 
 async def create_initial_data():
     """Crear datos iniciales"""
-    async with AsyncSessionLocal() as db:
+    from sqlalchemy import select
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    
+    # INSERT ... ON CONFLICT DO NOTHING: atómico frente a setups concurrentes y
+    # sin SELECT previo; ambos inserts se confirman en una única transacción
+    async with AsyncSessionLocal() as db, db.begin():
         # Crear tenant STANDARD
-        from sqlalchemy import select
-        
-        # Verificar si ya existe
-        stmt = select(Tenant).where(Tenant.slug == "STANDARD")
-        result = await db.execute(stmt)
-        standard_tenant = result.scalar_one_or_none()
+        stmt = (
+            pg_insert(Tenant)
+            .values(slug="STANDARD", name="Conocimiento Estándar SAP IS-U", timezone="Europe/Nicosia")
+            .on_conflict_do_nothing(index_elements=["slug"])
+            .returning(Tenant.id)
+        )
+        standard_tenant_id = (await db.execute(stmt)).scalar_one_or_none()
         
-        if not standard_tenant:
-            standard_tenant = Tenant(
-                slug="STANDARD",
-                name="Conocimiento Estándar SAP IS-U",
-                timezone="Europe/Nicosia"
-            )
-            db.add(standard_tenant)
+        if standard_tenant_id:
             logger.info("Created STANDARD tenant")
+        else:
+            # Ya existía: recuperar su id para asignarlo al admin
+            stmt = select(Tenant.id).where(Tenant.slug == "STANDARD")
+            standard_tenant_id = (await db.execute(stmt)).scalar_one()
         
-        # Crear usuario admin
-        stmt = select(User).where(User.email == "admin@sapisu.local")
-        result = await db.execute(stmt)
-        admin_user = result.scalar_one_or_none()
+        # Crear usuario admin. El hash de la contraseña es caro (bcrypt), así que
+        # solo se calcula si el admin no existe: la sonda por email usa el índice único
+        stmt = select(User.id).where(User.email == "admin@sapisu.local").limit(1)
+        if (await db.execute(stmt)).scalar_one_or_none():
+            return
         
-        if not admin_user:
-            hashed_password = AuthService.get_password_hash("admin123")
-            admin_user = User(
+        stmt = (
+            pg_insert(User)
+            .values(
                 email="admin@sapisu.local",
-                hashed_password=hashed_password,
+                hashed_password=AuthService.get_password_hash("admin123"),
                 role="admin",
-                tenant_id=standard_tenant.id
+                tenant_id=standard_tenant_id
             )
-            db.add(admin_user)
+            .on_conflict_do_nothing(index_elements=["email"])
+            .returning(User.id)
+        )
+        if (await db.execute(stmt)).scalar_one_or_none():
             logger.info("Created admin user: admin@sapisu.local / admin123")
-        
-        await db.commit()
 
 
 async def setup_qdrant():
@@ -80,23 +99,26 @@ async def setup_qdrant():
 async def run_database_migrations():
     """Ejecutar migraciones de base de datos"""
     try:
-        # Verificar si alembic está disponible
-        import subprocess
-        
-        result = subprocess.run(
-            ["alembic", "upgrade", "head"],
-            cwd=project_root / "api",
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode == 0:
-            logger.info("Database migrations completed successfully")
-        else:
-            logger.error(f"Migration failed: {result.stderr}")
-            
-    except FileNotFoundError:
+        # API de Alembic en el mismo proceso: sin lanzar otro intérprete
+        from alembic import command
+        from alembic.config import Config
+        from alembic.util import CommandError
+    except ImportError:
         logger.warning("Alembic not found, skipping migrations")
+        return
+    
+    api_dir = project_root / "api"
+    alembic_cfg = Config(str(api_dir / "alembic.ini"))
+    # Rutas absolutas: script_location del .ini es relativo al directorio de trabajo
+    alembic_cfg.set_main_option("script_location", str(api_dir / "alembic"))
+    
+    try:
+        # command.upgrade es síncrono; se ejecuta en un hilo para no bloquear el event loop
+        await asyncio.to_thread(command.upgrade, alembic_cfg, "head")
+        logger.info("Database migrations completed successfully")
+        
+    except CommandError as e:
+        logger.error(f"Migration failed: {e}")
     except Exception as e:
         logger.error(f"Error running migrations: {e}")
 
@@ -122,27 +144,11 @@ def create_env_file():
 
 def check_requirements():
     """Verificar dependencias"""
-    missing = []
-    
-    try:
-        import fastapi
-    except ImportError:
-        missing.append("fastapi")
-    
-    try:
-        import sqlalchemy
-    except ImportError:
-        missing.append("sqlalchemy")
-    
-    try:
-        import qdrant_client
-    except ImportError:
-        missing.append("qdrant-client")
-    
-    try:
-        import openai
-    except ImportError:
-        missing.append("openai")
+    # find_spec localiza el módulo sin importarlo ni ejecutar su __init__
+    missing = [
+        package for module, package in REQUIRED_MODULES
+        if importlib.util.find_spec(module) is None
+    ]
     
     if missing:
         logger.error(f"Missing required packages: {', '.join(missing)}")
@@ -153,26 +159,42 @@ def check_requirements():
     return True
 
 
+@dataclass
+class Preflight:
+    """Comprobaciones previas al setup, evaluadas todas de una vez"""
+    packages_ok: bool
+    env_present: bool
+    openai_ok: bool
+    jwt_ok: bool
+    
+    @classmethod
+    def run(cls) -> "Preflight":
+        return cls(
+            packages_ok=check_requirements(),
+            env_present=create_env_file(),
+            openai_ok=bool(settings.openai_api_key),
+            jwt_ok=bool(settings.jwt_secret) and settings.jwt_secret != DEFAULT_JWT_SECRET
+        )
+    
+    def report(self) -> bool:
+        """Registrar todos los fallos juntos; True si se puede continuar"""
+        if not self.env_present:
+            logger.warning("Please configure .env file and run setup again")
+        if not self.openai_ok:
+            logger.error("OPENAI_API_KEY not configured in .env")
+        if not self.jwt_ok:
+            logger.error("JWT_SECRET not properly configured in .env")
+        
+        return all(astuple(self))
+
+
 async def main():
     """Función principal de setup"""
     logger.info("Starting Wiki Inteligente SAP IS-U setup")
     
-    # 1. Verificar requirements
-    if not check_requirements():
-        sys.exit(1)
-    
-    # 2. Crear archivo .env
-    if not create_env_file():
-        logger.warning("Please configure .env file and run setup again")
-        sys.exit(1)
-    
-    # 3. Verificar configuración crítica
-    if not settings.openai_api_key:
-        logger.error("OPENAI_API_KEY not configured in .env")
-        sys.exit(1)
-    
-    if not settings.jwt_secret or settings.jwt_secret == "your_very_long_and_secure_secret_key_here_change_in_production":
-        logger.error("JWT_SECRET not properly configured in .env")
+    # 1-3. Requirements, archivo .env y configuración crítica en una sola pasada,
+    # antes de tocar base de datos o Qdrant
+    if not Preflight.run().report():
         sys.exit(1)
     
     try:
@@ -3,6 +3,7 @@
 import asyncio
 import aiohttp
 import json
+import os
 
 async def test_incidence_workflow():
     print("=== Test de Flujo Completo de Incidencias ===\n")
@@ -47,7 +48,28 @@ FECHA: 26/01/2025 15:30:00""",
         "source": "test-script"
     }
     
-    async with aiohttp.ClientSession() as session:
+    # Cliente Qdrant único para la línea base, la espera y la verificación
+    client = None
+    baseline = 0
+    try:
+        from qdrant_client import AsyncQdrantClient
+        from qdrant_client.models import FieldCondition, Filter, MatchText
+        # gRPC (puerto 6334) evita el JSON de REST; QDRANT_GRPC=0 vuelve a HTTP
+        client = AsyncQdrantClient(
+            host='localhost',
+            port=6333,
+            grpc_port=6334,
+            prefer_grpc=os.getenv('QDRANT_GRPC', '1') != '0'
+        )
+        baseline = (await client.get_collection('sapisu_knowledge')).points_count
+    except Exception as e:
+        print(f"⚠️  Qdrant no disponible, se omite la verificación: {e}")
+        client = None
+    
+    # Una sola sesión (pool keep-alive) para todas las peticiones a la API
+    connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
         try:
             # Guardar incidencia
             async with session.post('http://localhost:8000/api/v1/ingest/text-public', 
@@ -66,39 +88,47 @@ FECHA: 26/01/2025 15:30:00""",
         except Exception as e:
             print(f"❌ Error de conexión al guardar: {e}")
             return
-    
-    # 2. Esperar un momento para que se procese
-    print("\n2. Esperando procesamiento...")
-    await asyncio.sleep(3)
-    
-    # 3. Verificar que se almacenó en Qdrant
-    print("\n3. Verificando almacenamiento en Qdrant...")
-    try:
-        from qdrant_client import AsyncQdrantClient
-        client = AsyncQdrantClient(url='http://localhost:6333')
         
-        info = await client.get_collection('sapisu_knowledge')
-        print(f"   Puntos totales en Qdrant: {info.points_count}")
+        # 2. Esperar a que aparezcan los nuevos puntos (máximo 10s)
+        print("\n2. Esperando procesamiento...")
+        if client:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + 10
+            while loop.time() < deadline:
+                info = await client.get_collection('sapisu_knowledge')
+                if info.points_count > baseline:
+                    break
+                await asyncio.sleep(0.1)
         
-        if info.points_count > 0:
-            points = await client.scroll(
-                collection_name='sapisu_knowledge',
-                limit=3,
-                with_payload=True
-            )
+        # 3. Verificar que se almacenó en Qdrant
+        print("\n3. Verificando almacenamiento en Qdrant...")
+        try:
+            if client is None:
+                raise RuntimeError("cliente Qdrant no disponible")
             
-            for point in points[0]:
-                if point.payload and 'estimacion' in point.payload.get('content', '').lower():
-                    print(f"   ✅ Encontrada incidencia: {point.payload.get('title', 'Sin título')[:50]}...")
-                    break
-                    
-    except Exception as e:
-        print(f"   ⚠️  Error verificando Qdrant: {e}")
-    
-    # 4. Probar búsqueda a través del chat
-    print("\n4. Probando búsqueda a través del chat...")
-    
-    async with aiohttp.ClientSession() as session:
+            info = await client.get_collection('sapisu_knowledge')
+            print(f"   Puntos totales en Qdrant: {info.points_count}")
+            
+            if info.points_count > 0:
+                # El filtro de texto se evalúa en Qdrant: solo viaja el punto que coincide
+                points, _ = await client.scroll(
+                    collection_name='sapisu_knowledge',
+                    scroll_filter=Filter(must=[
+                        FieldCondition(key='content', match=MatchText(text='estimacion'))
+                    ]),
+                    limit=1,
+                    with_payload=True
+                )
+                
+                if points:
+                    print(f"   ✅ Encontrada incidencia: {points[0].payload.get('title', 'Sin título')[:50]}...")
+                        
+        except Exception as e:
+            print(f"   ⚠️  Error verificando Qdrant: {e}")
+        
+        # 4. Probar búsqueda a través del chat
+        print("\n4. Probando búsqueda a través del chat...")
+        
         try:
             search_data = {
                 "query": "problema con estimación de consumo gas industrial",
@@ -124,7 +154,16 @@ FECHA: 26/01/2025 15:30:00""",
         except Exception as e:
             print(f"❌ Error de conexión en búsqueda: {e}")
     
+    if client:
+        await client.close()
+    
     print("\n=== Test completado ===")
 
 if __name__ == "__main__":
+    # uvloop es opcional: si está instalado reduce la sobrecarga del event loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(test_incidence_workflow())
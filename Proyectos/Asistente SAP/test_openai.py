@@ -17,52 +17,57 @@ async def test_openai_connection():
     if api_key:
         print(f"🔑 API Key empieza con: {api_key[:10]}..." if len(api_key) > 10 else "Key muy corta")
     
-    # Test de embeddings
     client = AsyncOpenAI(api_key=api_key)
     
-    print("\n📡 Testeando embeddings...")
+    # Las tres pruebas comparten cliente y se lanzan a la vez
+    print("\n📡 Testeando embeddings, gpt-4o-mini y gpt-4.1-preview (modelo que está fallando)...")
     try:
-        response = await client.embeddings.create(
-            model="text-embedding-3-small",
-            input="test"
+        embed_result, chat_result, preview_result = await asyncio.gather(
+            _test_embeddings(client),
+            _test_chat(client, "gpt-4o-mini"),
+            _test_chat(client, "gpt-4.1-preview"),
+            return_exceptions=True
         )
-        print("✅ Embeddings funcionando correctamente")
-    except Exception as e:
-        print(f"❌ Error en embeddings: {e}")
+    finally:
+        await client.close()
+    
+    if isinstance(embed_result, Exception):
+        print(f"❌ Error en embeddings: {embed_result}")
         return False
+    print("✅ Embeddings funcionando correctamente")
     
-    print("\n🤖 Testeando chat con gpt-4o-mini...")
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Eres un asistente útil."},
-                {"role": "user", "content": "Di 'test exitoso'"}
-            ],
-            max_tokens=50
-        )
-        message = response.choices[0].message.content
-        print(f"✅ Chat funcionando: {message}")
-    except Exception as e:
-        print(f"❌ Error en chat: {e}")
+    if isinstance(chat_result, Exception):
+        print(f"❌ Error en chat: {chat_result}")
         return False
+    print(f"✅ Chat funcionando: {chat_result}")
     
-    print("\n🤖 Testeando chat con gpt-4.1-preview (modelo que está fallando)...")
-    try:
-        response = await client.chat.completions.create(
-            model="gpt-4.1-preview",
-            messages=[
-                {"role": "system", "content": "Eres un asistente útil."},
-                {"role": "user", "content": "Di 'test exitoso'"}
-            ],
-            max_tokens=50
-        )
-        message = response.choices[0].message.content
-        print(f"✅ Chat con gpt-4.1-preview funcionando: {message}")
-    except Exception as e:
-        print(f"❌ Error en chat con gpt-4.1-preview: {e}")
+    if isinstance(preview_result, Exception):
+        print(f"❌ Error en chat con gpt-4.1-preview: {preview_result}")
+    else:
+        print(f"✅ Chat con gpt-4.1-preview funcionando: {preview_result}")
     
     return True
 
+
+async def _test_embeddings(client: AsyncOpenAI):
+    """Petición mínima de embeddings"""
+    return await client.embeddings.create(
+        model="text-embedding-3-small",
+        input="test"
+    )
+
+
+async def _test_chat(client: AsyncOpenAI, model: str) -> str:
+    """Petición mínima de chat; devuelve el texto de la respuesta"""
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "Eres un asistente útil."},
+            {"role": "user", "content": "Di 'test exitoso'"}
+        ],
+        max_tokens=50
+    )
+    return response.choices[0].message.content
+
 if __name__ == "__main__":
     asyncio.run(test_openai_connection())
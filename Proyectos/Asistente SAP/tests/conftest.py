@@ -0,0 +1,31 @@
+"""
+Configuración común de pytest
+Wiki Inteligente SAP IS-U
+"""
+import pytest
+
+
+def pytest_addoption(parser):
+    """Opción --integration para ejecutar los tests contra servicios reales"""
+    parser.addoption(
+        "--integration",
+        action="store_true",
+        default=False,
+        help="Ejecutar tests de integración (requieren BD real)"
+    )
+
+
+def pytest_configure(config):
+    """Registrar el marcador de integración"""
+    config.addinivalue_line("markers", "integration: test que requiere servicios reales (--integration)")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Saltar los tests de integración salvo que se pida --integration"""
+    if config.getoption("--integration"):
+        return
+    
+    skip_integration = pytest.mark.skip(reason="Integration tests require --integration flag")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip_integration)
@@ -4,15 +4,24 @@ Wiki Inteligente SAP IS-U
 """
 import pytest
 import asyncio
-from httpx import AsyncClient
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 from api.main import app
 from api.db.database import get_db
-from api.db.models import Base
+from api.db.models import Base, User
+from api.services.auth import create_access_token
+from sqlalchemy import ARRAY, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.pool import StaticPool
 
 
+@compiles(ARRAY, "sqlite")
+def _compile_array_sqlite(type_, compiler, **kw):
+    """SQLite no tiene ARRAY: en la BD de prueba esas columnas se crean como JSON"""
+    return "JSON"
+
+
 # Base de datos de prueba en memoria
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
@@ -36,72 +45,66 @@ async def override_get_db():
 app.dependency_overrides[get_db] = override_get_db
 
 
-@pytest.fixture(scope="session")
-def event_loop():
-    """Event loop para tests async"""
-    loop = asyncio.new_event_loop()
-    yield loop
-    loop.close()
+async def _run_metadata(method):
+    """Ejecutar create_all/drop_all sobre el engine de pruebas"""
+    async with test_engine.begin() as conn:
+        await conn.run_sync(method)
 
 
 @pytest.fixture(scope="session")
-async def setup_database():
+def setup_database():
     """Setup de base de datos de prueba"""
-    async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(_run_metadata(Base.metadata.create_all))
     yield
-    async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
+    asyncio.run(_run_metadata(Base.metadata.drop_all))
 
 
-@pytest.fixture
-async def client(setup_database):
-    """Cliente HTTP de prueba"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        yield ac
+@pytest.fixture(scope="session")
+def client(setup_database):
+    """Cliente HTTP de prueba compartido (sin lifespan: no conecta con Qdrant ni inicializa la BD real)"""
+    return TestClient(app)
+
+
+async def _create_admin_user() -> User:
+    """Insertar el usuario admin de prueba (sin bcrypt: los tests no hacen login)"""
+    async with TestingSessionLocal() as session:
+        admin = User(
+            email="admin@test.com",
+            hashed_password="!",
+            role="admin",
+            is_active=True
+        )
+        session.add(admin)
+        await session.commit()
+        return admin
 
 
-@pytest.fixture
-async def admin_token(client):
-    """Token de administrador para tests"""
-    # Crear usuario admin de prueba
-    admin_data = {
-        "email": "admin@test.com",
-        "password": "testpassword123",
-        "role": "admin",
+@pytest.fixture(scope="session")
+def admin_token(setup_database):
+    """Token de administrador para tests, firmado en proceso una sola vez"""
+    admin = asyncio.run(_create_admin_user())
+    return create_access_token({
+        "sub": str(admin.id),
+        "email": admin.email,
+        "role": admin.role,
         "tenant_slug": "STANDARD"
-    }
-    
-    # Registrar admin (esto requeriría un endpoint especial para tests)
-    # Por simplicidad, asumir que existe
-    login_data = {
-        "email": "admin@test.com",
-        "password": "testpassword123"
-    }
-    
-    response = await client.post("/api/v1/auth/login", json=login_data)
-    if response.status_code == 200:
-        return response.json()["access_token"]
-    
-    return None
+    })
 
 
 class TestHealthEndpoints:
     """Tests de endpoints de salud"""
     
-    @pytest.mark.asyncio
-    async def test_root_endpoint(self, client):
+    def test_root_endpoint(self, client):
         """Test endpoint raíz"""
-        response = await client.get("/")
+        response = client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert "message" in data
         assert "version" in data
     
-    @pytest.mark.asyncio
-    async def test_health_check(self, client):
+    def test_health_check(self, client):
         """Test health check"""
-        response = await client.get("/health")
+        response = client.get("/health")
         assert response.status_code in [200, 503]  # Puede fallar por servicios externos
         
         if response.status_code == 200:
@@ -113,40 +116,32 @@ class TestHealthEndpoints:
 class TestAuthEndpoints:
     """Tests de autenticación"""
     
-    @pytest.mark.asyncio
-    async def test_login_invalid_credentials(self, client):
+    def test_login_invalid_credentials(self, client):
         """Test login con credenciales inválidas"""
         login_data = {
             "email": "invalid@test.com",
             "password": "wrongpassword"
         }
         
-        response = await client.post("/api/v1/auth/login", json=login_data)
+        response = client.post("/api/v1/auth/login", json=login_data)
         assert response.status_code == 401
     
-    @pytest.mark.asyncio
-    async def test_protected_endpoint_without_token(self, client):
-        """Test endpoint protegido sin token"""
-        response = await client.get("/api/v1/auth/me")
+    @pytest.mark.parametrize("method,path,payload", [
+        ("GET", "/api/v1/auth/me", None),
+        ("POST", "/api/v1/ingest/text", {"tenant_slug": "STANDARD", "text": "Test document content"}),
+        ("GET", "/api/v1/ingest/documents", None),
+        ("GET", "/api/v1/admin/tenants", None),
+    ])
+    def test_protected_endpoints_without_token(self, client, method, path, payload):
+        """Test endpoints protegidos sin token"""
+        response = client.request(method, path, json=payload)
         assert response.status_code == 401
 
 
 class TestIngestEndpoints:
     """Tests de ingesta"""
     
-    @pytest.mark.asyncio
-    async def test_ingest_text_without_auth(self, client):
-        """Test ingesta sin autenticación"""
-        document_data = {
-            "tenant_slug": "STANDARD",
-            "text": "Test document content"
-        }
-        
-        response = await client.post("/api/v1/ingest/text", json=document_data)
-        assert response.status_code == 401
-    
-    @pytest.mark.asyncio
-    async def test_ingest_text_invalid_data(self, client, admin_token):
+    def test_ingest_text_invalid_data(self, client, admin_token):
         """Test ingesta con datos inválidos"""
         if not admin_token:
             pytest.skip("No admin token available")
@@ -159,7 +154,7 @@ class TestIngestEndpoints:
             "text": "Short"
         }
         
-        response = await client.post(
+        response = client.post(
             "/api/v1/ingest/text", 
             json=document_data, 
             headers=headers
@@ -167,43 +162,17 @@ class TestIngestEndpoints:
         assert response.status_code == 422
 
 
-class TestSearchEndpoints:
-    """Tests de búsqueda"""
-    
-    @pytest.mark.asyncio
-    async def test_search_without_auth(self, client):
-        """Test búsqueda sin autenticación"""
-        search_data = {
-            "tenant_slug": "STANDARD",
-            "query": "test query"
-        }
-        
-        response = await client.post("/api/v1/search/vector", json=search_data)
-        assert response.status_code == 401
-    
-    @pytest.mark.asyncio
-    async def test_chat_without_auth(self, client):
-        """Test chat sin autenticación"""
-        chat_data = {
-            "tenant_slug": "STANDARD",
-            "query": "¿Cómo hacer una facturación?"
-        }
-        
-        response = await client.post("/api/v1/search/chat", json=chat_data)
-        assert response.status_code == 401
-
-
 class TestRateLimiting:
     """Tests de rate limiting"""
     
-    @pytest.mark.asyncio
-    async def test_health_rate_limit(self, client):
+    def test_health_rate_limit(self, client):
         """Test rate limit en health check"""
-        # Hacer muchas requests seguidas
-        responses = []
-        for _ in range(15):  # Más del límite de 10/minuto
-            response = await client.get("/health")
-            responses.append(response.status_code)
+        # Ráfaga de requests concurrentes, más del límite de 10/minuto
+        with ThreadPoolExecutor(max_workers=15) as executor:
+            responses = [
+                response.status_code
+                for response in executor.map(lambda _: client.get("/health"), range(15))
+            ]
         
         # Alguna debería ser 429 (rate limited)
         assert 429 in responses or all(code in [200, 503] for code in responses)
@@ -212,10 +181,9 @@ class TestRateLimiting:
 class TestCORS:
     """Tests de CORS"""
     
-    @pytest.mark.asyncio
-    async def test_cors_headers(self, client):
+    def test_cors_headers(self, client):
         """Test headers CORS"""
-        response = await client.options("/")
+        response = client.options("/")
         
         # Verificar que no falla
         assert response.status_code in [200, 405]  # 405 si OPTIONS no está implementado
@@ -226,17 +194,14 @@ class TestDatabaseIntegration:
     """Tests de integración con BD"""
     
     @pytest.mark.asyncio
-    @pytest.mark.skipif(
-        not pytest.config.getoption("--integration", default=False),
-        reason="Integration tests require --integration flag"
-    )
+    @pytest.mark.integration
     async def test_database_connection(self):
         """Test conexión a base de datos real"""
         from api.db.database import engine
         
         try:
             async with engine.begin() as conn:
-                result = await conn.execute("SELECT 1")
+                result = await conn.execute(text("SELECT 1"))
                 assert result.scalar() == 1
         except Exception as e:
             pytest.fail(f"Database connection failed: {e}")
@@ -3,8 +3,14 @@ Tests unitarios para servicios de embeddings
 Wiki Inteligente SAP IS-U
 """
 import pytest
-from unittest.mock import AsyncMock, patch
-from api.services.embeddings import EmbeddingService, QdrantService, MetadataExtractor
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from qdrant_client.models import PayloadSelectorInclude, PointStruct
+from api.services.embeddings import EmbeddingService, QdrantService
+from api.services.ingest import DocumentProcessor, MetadataExtractor
+from api.utils.cache import SearchCache
 
 
 class TestMetadataExtractor:
@@ -47,6 +53,10 @@ class TestMetadataExtractor:
         topic = MetadataExtractor.infer_topic([], [], "problema con facturación")
         assert topic == "billing"
         
+        # Prioridad entre temas y palabras solapadas
+        assert MetadataExtractor.infer_topic([], [], "contrato de baja") == "move-out"
+        assert MetadataExtractor.infer_topic([], [], "desconexion") == "move-in"
+        
         # Sin coincidencias
         topic = MetadataExtractor.infer_topic([], [], "contenido genérico")
         assert topic is None
@@ -55,6 +65,11 @@ class TestMetadataExtractor:
 class TestEmbeddingService:
     """Tests para servicio de embeddings"""
     
+    @pytest.fixture(autouse=True)
+    def clear_embedding_cache(self):
+        """Vaciar la caché compartida entre tests"""
+        EmbeddingService._cache.clear()
+    
     @pytest.mark.asyncio
     async def test_chunk_text(self):
         """Test división en chunks"""
@@ -79,6 +94,14 @@ class TestEmbeddingService:
         assert isinstance(token_count, int)
         assert token_count > 0
     
+    def test_count_tokens_batch(self):
+        """Test conteo de tokens en lote coincide con el individual"""
+        service = EmbeddingService()
+        
+        texts = ["Hola mundo", "Usar EC85 para facturación", ""]
+        
+        assert service.count_tokens_batch(texts) == [service.count_tokens(text) for text in texts]
+    
     def test_generate_content_hash(self):
         """Test generación de hash"""
         service = EmbeddingService()
@@ -97,8 +120,7 @@ class TestEmbeddingService:
     async def test_get_embeddings(self, mock_openai):
         """Test obtención de embeddings"""
         # Mock de OpenAI response
-        mock_response = AsyncMock()
-        mock_response.data = [AsyncMock(embedding=[0.1, 0.2, 0.3])]
+        mock_response = SimpleNamespace(data=[SimpleNamespace(embedding=[0.1, 0.2, 0.3])])
         
         mock_client = AsyncMock()
         mock_client.embeddings.create.return_value = mock_response
@@ -110,22 +132,141 @@ class TestEmbeddingService:
         embeddings = await service.get_embeddings(["test text"])
         
         assert len(embeddings) == 1
-        assert embeddings[0] == [0.1, 0.2, 0.3]
+        assert embeddings[0] == pytest.approx([0.1, 0.2, 0.3])  # Caché en float32
+        mock_client.embeddings.create.assert_called_once()
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.EMBEDDING_MAX_BATCH', 2)
+    @patch('api.services.embeddings.AsyncOpenAI')
+    async def test_get_embeddings_batches(self, mock_openai):
+        """Test reparto en lotes manteniendo el orden de entrada"""
+        async def fake_create(model, input):
+            return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text))]) for text in input])
+        
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.side_effect = fake_create
+        
+        service = EmbeddingService()
+        service.client = mock_client
+        
+        embeddings = await service.get_embeddings(["a", "bb", "ccc"])
+        
+        assert embeddings == [[1.0], [2.0], [3.0]]
+        assert mock_client.embeddings.create.call_count == 2
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncOpenAI')
+    async def test_get_embeddings_cache_hit(self, mock_openai):
+        """Test que los textos ya embebidos no vuelven a OpenAI"""
+        mock_response = SimpleNamespace(data=[SimpleNamespace(embedding=[0.5, 0.5])])
+        
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.return_value = mock_response
+        
+        service = EmbeddingService()
+        service.client = mock_client
+        
+        first = await service.get_embeddings(["texto repetido"])
+        second = await service.get_embeddings(["texto repetido", "texto repetido"])
+        
+        assert second == [first[0], first[0]]
         mock_client.embeddings.create.assert_called_once()
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncOpenAI')
+    async def test_get_embeddings_returns_copies(self, mock_openai):
+        """Test que modificar un vector devuelto no corrompe la caché"""
+        mock_response = SimpleNamespace(data=[SimpleNamespace(embedding=[0.5, 0.25])])
+        
+        mock_client = AsyncMock()
+        mock_client.embeddings.create.return_value = mock_response
+        
+        service = EmbeddingService()
+        service.client = mock_client
+        
+        first = await service.get_embeddings(["texto", "texto"])
+        assert first[0] is not first[1]
+        first[0][0] = 99.0
+        
+        second = await service.get_embeddings(["texto"])
+        assert second == [[0.5, 0.25]]
+        mock_client.embeddings.create.assert_called_once()
+
+
+class TestDocumentProcessor:
+    """Tests para el troceado e indexado de documentos"""
+    
+    @pytest.fixture
+    def processor(self):
+        with patch('api.services.ingest.EmbeddingService'), \
+             patch('api.services.ingest.QdrantService'), \
+             patch('api.services.ingest.LLMService'):
+            processor = DocumentProcessor()
+        processor.embedding_service = MagicMock()
+        processor.embedding_service.chunk_text.return_value = [
+            {"index": i, "content": f"chunk {i}", "token_count": 2} for i in range(3)
+        ]
+        processor.embedding_service.get_embeddings = AsyncMock(
+            side_effect=lambda texts: [[float(i)] for i in range(len(texts))]
+        )
+        processor.qdrant_service = MagicMock()
+        processor.qdrant_service.upsert_points = AsyncMock()
+        return processor
+    
+    @pytest.fixture
+    def document(self):
+        return SimpleNamespace(
+            id=uuid.uuid4(), tenant_slug="STANDARD", scope="standard", system="ISU",
+            topic="billing", tcodes=["EC85"], tables=None,
+            created_at=datetime(2024, 1, 1), source="manual"
+        )
+    
+    @pytest.mark.asyncio
+    async def test_process_chunks(self, processor, document):
+        """Test que cada chunk llega a Qdrant y a Postgres con el mismo point id"""
+        db = AsyncMock()
+        
+        count = await processor._process_chunks(document, "texto", db)
+        
+        assert count == 3
+        points = processor.qdrant_service.upsert_points.await_args.args[0]
+        assert [p.payload["chunk_index"] for p in points] == [0, 1, 2]
+        assert points[0].payload["tenant"] == "STANDARD"
+        assert points[0].payload["tables"] == []
+        
+        records = db.execute.await_args.args[1]
+        assert [r["qdrant_point_id"] for r in records] == [p.id for p in points]
+        assert all(r["document_id"] == document.id for r in records)
+        db.commit.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    @patch('api.services.ingest.settings')
+    async def test_process_chunks_truncates(self, mock_settings, processor, document):
+        """Test truncado a max_chunks_per_doc"""
+        mock_settings.max_chunks_per_doc = 2
+        db = AsyncMock()
+        
+        count = await processor._process_chunks(document, "texto", db)
+        
+        assert count == 2
+        processor.embedding_service.get_embeddings.assert_awaited_once_with(["chunk 0", "chunk 1"])
+        assert len(processor.qdrant_service.upsert_points.await_args.args[0]) == 2
 
 
 class TestQdrantService:
     """Tests para servicio Qdrant"""
     
+    @pytest.fixture(autouse=True)
+    def clear_collection_info_cache(self):
+        """Vaciar la caché de info de colección entre tests"""
+        QdrantService._collection_info_cache.clear()
+    
     @pytest.mark.asyncio
     @patch('api.services.embeddings.AsyncQdrantClient')
     async def test_search(self, mock_qdrant):
         """Test búsqueda vectorial"""
         # Mock de Qdrant response
-        mock_hit = AsyncMock()
-        mock_hit.id = "test_id"
-        mock_hit.score = 0.95
-        mock_hit.payload = {"tenant": "TEST", "content": "test content"}
+        mock_hit = SimpleNamespace(id="test_id", score=0.95, payload={"tenant": "TEST", "content": "test content"})
         
         mock_client = AsyncMock()
         mock_client.search.return_value = [mock_hit]
@@ -145,14 +286,73 @@ class TestQdrantService:
         assert results[0]["score"] == 0.95
         assert results[0]["payload"]["tenant"] == "TEST"
     
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncQdrantClient')
+    async def test_search_payload_fields(self, mock_qdrant):
+        """Test que payload_fields se envía como selector de payload"""
+        mock_client = AsyncMock()
+        mock_client.search.return_value = []
+        mock_qdrant.return_value = mock_client
+        
+        service = QdrantService()
+        service.client = mock_client
+        
+        await service.search(
+            query_vector=[0.1, 0.2, 0.3],
+            tenant_filter=["TEST"],
+            top_k=5,
+            payload_fields=["content", "source"]
+        )
+        
+        kwargs = mock_client.search.call_args.kwargs
+        assert kwargs["with_payload"] == PayloadSelectorInclude(include=["content", "source"])
+        assert kwargs["with_vectors"] is False
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncQdrantClient')
+    async def test_search_cache_hit(self, mock_qdrant):
+        """Test que un acierto de caché evita la búsqueda en Qdrant"""
+        cached_results = [{"id": "cached_id", "score": 0.9, "payload": {"tenant": "TEST"}}]
+        
+        mock_client = AsyncMock()
+        mock_qdrant.return_value = mock_client
+        
+        service = QdrantService()
+        service.client = mock_client
+        service.cache = MagicMock()
+        service.cache.make_keys = AsyncMock(return_value=["qdrs:test"])
+        service.cache.get_many = AsyncMock(return_value=[cached_results])
+        
+        results = await service.search(
+            query_vector=[0.1, 0.2, 0.3],
+            tenant_filter=["TEST"],
+            top_k=5
+        )
+        
+        assert results == cached_results
+        mock_client.search.assert_not_called()
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncQdrantClient')
+    async def test_upsert_invalidates_search_cache(self, mock_qdrant):
+        """Test que escribir puntos vacía la caché de búsquedas"""
+        mock_client = AsyncMock()
+        mock_qdrant.return_value = mock_client
+        
+        service = QdrantService()
+        service.client = mock_client
+        service.cache = MagicMock()
+        service.cache.invalidate = AsyncMock()
+        
+        await service.upsert_points([PointStruct(id=1, vector=[0.1], payload={"tenant": "TEST"})])
+        
+        service.cache.invalidate.assert_awaited_once_with({"TEST"})
+    
     @pytest.mark.asyncio
     @patch('api.services.embeddings.AsyncQdrantClient')
     async def test_get_collection_info(self, mock_qdrant):
         """Test información de colección"""
-        mock_info = AsyncMock()
-        mock_info.status = "green"
-        mock_info.vectors_count = 100
-        mock_info.points_count = 100
+        mock_info = SimpleNamespace(status="green", vectors_count=100, indexed_vectors_count=100, points_count=100)
         
         mock_client = AsyncMock()
         mock_client.get_collection.return_value = mock_info
@@ -165,7 +365,43 @@ class TestQdrantService:
         
         assert info["status"] == "green"
         assert info["points_count"] == 100
+    
+    @pytest.mark.asyncio
+    @patch('api.services.embeddings.AsyncQdrantClient')
+    async def test_get_collection_info_cached(self, mock_qdrant):
+        """Test que la info de colección se reutiliza dentro del TTL"""
+        mock_info = SimpleNamespace(status="green", vectors_count=100, indexed_vectors_count=100, points_count=100)
+        
+        mock_client = AsyncMock()
+        mock_client.get_collection.return_value = mock_info
+        mock_qdrant.return_value = mock_client
+        
+        first = await QdrantService().get_collection_info()
+        second = await QdrantService().get_collection_info()
+        
+        assert first == second
+        mock_client.get_collection.assert_awaited_once()
+
 
 
+class TestSearchCache:
+    """Tests para la caché de búsquedas"""
+    
+    @pytest.mark.asyncio
+    async def test_tenant_generation_changes_key(self):
+        """Test que invalidar un tenant cambia sus claves y no las de otros"""
+        cache = SearchCache()
+        cache.client = MagicMock()
+        cache.client.mget = AsyncMock(return_value=[None, None, None])
+        
+        before = await cache.make_keys([[0.1], [0.1]], [["A"], ["B"]], top_k=5)
+        
+        # Generaciones en orden: global, A, B
+        cache.client.mget = AsyncMock(return_value=[None, b"1", None])
+        after = await cache.make_keys([[0.1], [0.1]], [["A"], ["B"]], top_k=5)
+        
+        assert before[0] != after[0]
+        assert before[1] == after[1]
+
 if __name__ == "__main__":
     pytest.main([__file__])
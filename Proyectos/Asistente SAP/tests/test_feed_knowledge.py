@@ -0,0 +1,42 @@
+"""
+Tests del alimentador de conocimiento contra un servidor aiohttp local
+Wiki Inteligente SAP IS-U
+"""
+import pytest
+from unittest.mock import patch
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from scripts.feed_knowledge import KnowledgeFeeder
+
+
+class TestUploadFiles:
+    """Tests de subida de binarios a /ingest/files"""
+    
+    @pytest.mark.asyncio
+    async def test_upload_retries_after_503(self, tmp_path):
+        """Test que un 503 se reintenta reenviando el archivo completo"""
+        statuses = [503, 200]
+        received = []
+        
+        async def ingest_files(request):
+            form = await request.post()
+            received.append(form["files"].file.read())
+            status = statuses.pop(0)
+            if status != 200:
+                return web.Response(status=status, headers={"Retry-After": "0"})
+            return web.json_response([{"filename": "doc.pdf", "success": True}])
+        
+        app = web.Application()
+        app.router.add_post("/api/v1/ingest/files", ingest_files)
+        
+        file_path = tmp_path / "doc.pdf"
+        file_path.write_bytes(b"%PDF-1.4 contenido de prueba")
+        
+        async with TestServer(app) as server:
+            with patch("scripts.feed_knowledge.INGEST_FILES_URL", str(server.make_url("/api/v1/ingest/files"))), \
+                 patch("scripts.feed_knowledge.HEALTH_URL", str(server.make_url("/health"))):
+                async with KnowledgeFeeder() as feeder:
+                    await feeder._upload_files_async([file_path])
+        
+        assert statuses == []
+        assert received == [b"%PDF-1.4 contenido de prueba"] * 2
@@ -0,0 +1,33 @@
+"""
+Tests unitarios para la estructura de conocimiento
+Wiki Inteligente SAP IS-U
+"""
+from docs.knowledge_structure import Category, knowledge_structure, render_format
+
+
+class TestCategory:
+    """Tests para el enum de categorías"""
+    
+    def test_category_order_matches_structure(self):
+        """Test que Category indexa knowledge_structure en el mismo orden"""
+        names = [name.split(" ", 1)[1] for name in knowledge_structure]
+        
+        assert names == [c.name for c in Category]
+
+
+class TestRenderFormat:
+    """Tests para el relleno de plantillas de formato"""
+    
+    def test_accented_placeholder(self):
+        """Test que [TÍTULO] se rellena como el resto de placeholders"""
+        rendered = render_format(Category.FUNCTIONAL_SPECS, TÍTULO="Facturación masiva")
+        
+        assert "Especificación: Facturación masiva" in rendered
+        assert "[TÍTULO]" not in rendered
+    
+    def test_descriptive_placeholders_kept(self):
+        """Test que los placeholders descriptivos se conservan"""
+        rendered = render_format(Category.TRAINING_MATERIALS, TITULO="Lecturas")
+        
+        assert rendered.startswith("Guía: Lecturas")
+        assert "[Usuario final/Técnico/Funcional]" in rendered
@@ -0,0 +1,31 @@
+"""
+Tests unitarios para métricas de evaluación del scheduler
+Wiki Inteligente SAP IS-U
+"""
+import pytest
+from scheduler.main import ranking_metrics
+
+
+class TestRankingMetrics:
+    """Tests para nDCG@k y Hit@k"""
+    
+    def test_perfect_ranking(self):
+        """Test ranking perfecto da nDCG 1"""
+        ndcg, hit = ranking_metrics([["doc1", "doc2"]], [frozenset({"doc1", "doc2"})])
+        
+        assert ndcg == pytest.approx(1.0)
+        assert hit == 1.0
+    
+    def test_repeated_document_chunks(self):
+        """Test varios chunks del mismo documento no inflan nDCG por encima de 1"""
+        ndcg, hit = ranking_metrics([["doc1", "doc1", "doc2"]], [frozenset({"doc1"})])
+        
+        assert ndcg == pytest.approx(1.0)
+        assert hit == 1.0
+    
+    def test_no_hits(self):
+        """Test sin documentos esperados recuperados"""
+        ndcg, hit = ranking_metrics([["doc3"]], [frozenset({"doc1"})])
+        
+        assert ndcg == 0.0
+        assert hit == 0.0